@@ -1,7 +1,7 @@
-from rest_framework import HTTP_HEADER_ENCODING, exceptions
+from rest_framework import exceptions
 from rest_framework.authentication import TokenAuthentication as rest_framework_TokenAuthentication
 from django.utils.translation import ugettext_lazy as _
-from emailcongress.models import Token
+from emailcongress.models import Token, DjangoUser
 
 
 class TokenAuthentication(rest_framework_TokenAuthentication):
@@ -19,17 +19,31 @@ class TokenAuthentication(rest_framework_TokenAuthentication):
     model = Token
 
     def authenticate_credentials(self, key):
-
-        try:
-            token = self.model.objects.select_related('user').get(key=key)
-        except self.model.DoesNotExist:
+        """
+        Authenticates with the cached credentials of the token (see Token.api_credentials) so that a call only
+        queries for the django user it authenticates as. The token handed back as request.auth isn't loaded from the
+        database, it's built from the key and the user it belongs to so key, user and content_object work as usual.
+
+        @param key: the string key of the token
+        @type key: str
+        @return: tuple of the django user and the token
+        @rtype: (DjangoUser, Token)
+        """
+        credentials = self.model.api_credentials(key)
+        if credentials is None:
             raise exceptions.AuthenticationFailed(_('Invalid token.'))
 
-        if not token.user.is_active:
+        user_id, is_active, has_api_perm = credentials
+        if not is_active:
             raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
 
-        if not (token.user.is_superuser or token.user.has_perm('emailcongress.api')):
+        if not has_api_perm:
             raise exceptions.AuthenticationFailed(_("This token doesn't have API permissions. "
                                                     "Request access at https://emailcongress/developers"))
 
-        return (token.user, token)
+        user = DjangoUser.objects.select_related('user').filter(pk=user_id, is_active=True, user__isnull=False).first()
+        if user is None:
+            self.model.uncache_key(key)
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (user, self.model(key=key, content_object=user.user))
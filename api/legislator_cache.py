@@ -0,0 +1,87 @@
+import calendar
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+
+from emailcongress.directory import legislator_directory
+
+
+class LegislatorPayloads(object):
+    """
+    Serialized legislators for the API. The payloads only change when legislators are imported, which bumps the
+    legislator namespace version, so each version is serialized once, shared through the cache backend and held in
+    memory by every process until the version changes again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._payloads = None
+
+    @staticmethod
+    def _key(version):
+        return 'api:legislators:{0}'.format(version)
+
+    @staticmethod
+    def _serialize():
+        from emailcongress.models import Legislator
+        from api.serializers import LegislatorSerializer
+
+        legislators = list(Legislator.objects.order_by('pk'))
+        last_modified = Legislator.objects.aggregate(Max('updated_at'))['updated_at__max']
+        return {
+            'results': [dict(row) for row in LegislatorSerializer(legislators, many=True).data],
+            'pks': [str(leg.pk) for leg in legislators],
+            'last_modified': calendar.timegm(last_modified.utctimetuple()) if last_modified else None,
+        }
+
+    def current(self):
+        """
+        @return: serialized legislators in primary key order under 'results', their primary keys under 'pks', the
+                 unix time of the latest change under 'last_modified' and the data version under 'version'
+        @rtype: dict
+        """
+        version = legislator_directory.version
+        payloads = self._payloads
+        if payloads is not None and payloads['version'] == version:
+            return payloads
+
+        with self._lock:
+            if self._payloads is None or self._payloads['version'] != version:
+                payloads = cache.get(self._key(version))
+                if payloads is None:
+                    payloads = self._serialize()
+                    cache.set(self._key(version), payloads,
+                              timeout=settings.CONFIG_DICT['misc'].get('legislator_api_cache_ttl', 60 * 60 * 24))
+                payloads['version'] = version
+                payloads['by_pk'] = dict(zip(payloads['pks'], payloads['results']))
+                self._payloads = payloads
+            return self._payloads
+
+    @staticmethod
+    def _matches(value, candidates):
+        if isinstance(value, bool):
+            return str(value).lower() in {c.lower() for c in candidates} or \
+                   str(int(value)) in candidates
+        return value is not None and str(value) in candidates
+
+    def filter(self, query):
+        """
+        Filters the serialized legislators the same way GenericQueryModelViewSet filters a queryset, i.e. each
+        field has to match one of the comma separated values given for it.
+
+        @param query: serialized field name to list of accepted values
+        @type query: dict[str, list[str]]
+        @return: matching serialized legislators or None if a field isn't part of the serialized payload
+        @rtype: list[dict]|None
+        """
+        results = self.current()['results']
+        if not results:
+            return []
+        if any(field not in results[0] for field in query):
+            return None
+        return [row for row in results if all(self._matches(row[field], vals) for field, vals in query.items())]
+
+
+legislator_payloads = LegislatorPayloads()
@@ -0,0 +1,129 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.http import StreamingHttpResponse
+from rest_framework import exceptions
+from rest_framework.pagination import BasePagination
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates by the primary key instead of an OFFSET. Each page is fetched with `id > last id of the previous page`
+    on the primary key index, so deep pages are as cheap as the first one and rows added or removed between
+    requests don't shift the pages. Pagination is opt-in: only requests that pass cursor or page_size get a page
+    wrapped as {"next": ..., "results": [...]}, every other request still gets the full list.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 1000
+
+    def __init__(self):
+        self.request = None
+        self.next_position = None
+
+    @staticmethod
+    def encode_cursor(position):
+        return base64.urlsafe_b64encode(json.dumps({'id': position}).encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            return int(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))['id'])
+        except:
+            raise exceptions.NotFound('Invalid cursor.')
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            page_size = self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        @param queryset: filtered queryset to paginate
+        @type queryset: django.db.models.query.QuerySet
+        @param request: the request with the cursor and page_size parameters
+        @type request: rest_framework.request.Request
+        @return: the objects of the requested page or None if the request didn't ask for a page
+        @rtype: list|None
+        """
+        if not any(param in request.query_params for param in (self.cursor_query_param, self.page_size_query_param)):
+            return None
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+
+        queryset = queryset.order_by('pk')
+        if cursor:
+            queryset = queryset.filter(pk__gt=self.decode_cursor(cursor))
+
+        # one extra row tells whether there is a next page without a COUNT
+        page = list(queryset[:page_size + 1])
+        self.next_position = page[page_size - 1].pk if len(page) > page_size else None
+        return page[:page_size]
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([('next', self.get_next_link()), ('results', data)]))
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders newline delimited JSON, one object per line. List views stream their results in this format (see
+    stream_ndjson) so this only renders single objects and errors.
+    """
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(row, cls=JSONEncoder) + '\n' for row in rows).encode('utf-8')
+
+
+def stream_ndjson(queryset, serialize, chunk_size=1000):
+    """
+    Streams every row of a queryset as newline delimited JSON. Rows are fetched in primary key order one chunk at a
+    time so memory use doesn't grow with the size of the table.
+
+    @param queryset: filtered queryset to stream
+    @type queryset: django.db.models.query.QuerySet
+    @param serialize: turns a model instance into a JSON serializable dict
+    @type serialize: callable
+    @param chunk_size: number of rows fetched per query
+    @type chunk_size: int
+    @return: streaming response
+    @rtype: django.http.StreamingHttpResponse
+    """
+    def rows():
+        last = None
+        while True:
+            chunk = queryset.order_by('pk')
+            if last is not None:
+                chunk = chunk.filter(pk__gt=last)
+            chunk = list(chunk[:chunk_size])
+            if not chunk:
+                return
+            yield ''.join(json.dumps(serialize(obj), cls=JSONEncoder) + '\n' for obj in chunk)
+            if len(chunk) < chunk_size:
+                return
+            last = chunk[-1].pk
+
+    return StreamingHttpResponse(rows(), content_type=NDJSONRenderer.media_type)
@@ -10,14 +10,39 @@ from rest_framework.decorators import detail_route, list_route
 from django.core.exceptions import FieldError
 from rest_framework.views import exception_handler
 from rest_framework import exceptions
+from rest_framework import status
+from django.utils.http import http_date, parse_http_date_safe
 from datetime import datetime
+from django.conf import settings
+from rest_framework.settings import api_settings
 from emailcongress import emailer
+from api.pagination import KeysetPagination, NDJSONRenderer, stream_ndjson
+from api.legislator_cache import legislator_payloads
 import traceback
 
 
 class GenericQueryModelViewSet(viewsets.ModelViewSet):
     __metaclass__ = abc.ABCMeta
 
+    pagination_class = KeysetPagination
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+    # query parameters that control the response rather than filter the queryset
+    reserved_query_params = {api_settings.URL_FORMAT_OVERRIDE, KeysetPagination.cursor_query_param,
+                             KeysetPagination.page_size_query_param}
+
+    def get_query(self):
+        """
+        @return: field name to list of accepted values for every filtering GET parameter
+        @rtype: dict[str, list[str]]
+        """
+        query = {}
+        for key, val in self.request.query_params.dict().items():
+            if key in self.reserved_query_params:
+                continue
+            query[key] = val.split(',')
+            # TODO strip empty space?
+        return query
+
     def get_queryset(self):
         """
         Handles querying with GET parameters in an abstract way.
@@ -27,11 +52,7 @@ class GenericQueryModelViewSet(viewsets.ModelViewSet):
         """
         try:
             queryset = self.queryset
-
-            query = {}
-            for key, val in self.request.query_params.dict().items():
-                query[key] = val.split(',')
-                # TODO strip empty space?
+            query = self.get_query()
 
             for key in list(query.keys()):
                 val = query[key]
@@ -47,6 +68,17 @@ class GenericQueryModelViewSet(viewsets.ModelViewSet):
         except:
             raise exceptions.APIException
 
+    def list(self, request, *args, **kwargs):
+        """
+        Lists the filtered queryset, one page at a time when requested with ?page_size= or ?cursor= (see
+        KeysetPagination), or streams all of it as newline delimited JSON when requested with ?format=ndjson or
+        Accept: application/x-ndjson.
+        """
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return stream_ndjson(self.filter_queryset(self.get_queryset()),
+                                 lambda obj: self.get_serializer(obj).data)
+        return super().list(request, *args, **kwargs)
+
 
 class UserViewSet(GenericQueryModelViewSet):
     queryset = models.User.objects.all()
@@ -56,11 +88,67 @@ class UserViewSet(GenericQueryModelViewSet):
 class LegislatorViewSet(GenericQueryModelViewSet):
     queryset = models.Legislator.objects.all()
     serializer_class = LegislatorSerializer
+    # a few hundred rows that clients expect in one response
+    pagination_class = None
 
+    @staticmethod
+    def etag(request, payloads):
+        return '"legislators-{0}-{1}"'.format(payloads['version'], request.accepted_renderer.format)
+
+    def respond(self, request, payloads, data):
+        """
+        Answers with 304 Not Modified if the client's copy is current and otherwise with the data. Both carry the
+        ETag and Last-Modified of the legislator data so clients can revalidate.
 
-class MessageViewSet(viewsets.ModelViewSet):
+        @param payloads: current legislator payloads
+        @type payloads: dict
+        @param data: serialized data to respond with
+        @type data: list|dict
+        @return: response
+        @rtype: rest_framework.response.Response
+        """
+        etag = self.etag(request, payloads)
+        last_modified = payloads['last_modified']
+
+        # If-None-Match takes precedence over If-Modified-Since
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            not_modified = '*' in tags or etag in tags or 'W/' + etag in tags
+        else:
+            if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+            not_modified = None not in (if_modified_since, last_modified) and last_modified <= if_modified_since
+
+        response = Response(status=status.HTTP_304_NOT_MODIFIED) if not_modified else Response(data)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        """
+        Answers from the cached legislator payloads. Filters on serialized fields are applied in memory and any
+        other filter falls back to querying the database.
+        """
+        payloads = legislator_payloads.current()
+        data = legislator_payloads.filter(self.get_query())
+        if data is None:
+            data = self.get_serializer(self.get_queryset(), many=True).data
+        return self.respond(request, payloads, data)
+
+    def retrieve(self, request, *args, **kwargs):
+        payloads = legislator_payloads.current()
+        data = payloads['by_pk'].get(str(kwargs.get(self.lookup_url_kwarg or self.lookup_field)))
+        if data is None:
+            raise exceptions.NotFound
+        return self.respond(request, payloads, data)
+
+
+class MessageViewSet(GenericQueryModelViewSet):
     queryset = models.Message.objects.all()
     serializer_class = MessageSerializer
+    # most messages accepted by one send_batch call
+    max_batch_size = 1000
 
     @staticmethod
     def process_inbound_message(django_user, umi, msg, test=False):
@@ -110,3 +198,106 @@ class MessageViewSet(viewsets.ModelViewSet):
             return Response({'data': self.serializer_class(new_msg).data, 'status': sent})
         except:
             raise exceptions.APIException('Error while trying to submit email.')
+
+    @staticmethod
+    def build_message(params, umi):
+        """
+        Validates one message of a batch submission.
+
+        @param params: the submitted message with to, subject, body and optionally send_date and email_uid
+        @type params: dict
+        @param umi: user message info the message is sent with
+        @type umi: models.UserMessageInfo
+        @return: the unsaved message
+        @rtype: models.Message
+        @raise ValueError: describing what is wrong with the message
+        """
+        if not isinstance(params, dict):
+            raise ValueError('Expected an object with to, subject and body.')
+        missing = [field for field in ['to', 'subject', 'body'] if not params.get(field)]
+        if missing:
+            raise ValueError('Missing {0}.'.format(', '.join(missing)))
+
+        to = [params['to']] if isinstance(params['to'], str) else params['to']
+        if not isinstance(to, list) or not all(isinstance(addr, str) for addr in to):
+            raise ValueError('Expected to to be a list of email addresses.')
+
+        send_date = datetime.now()
+        if 'send_date' in params:
+            try:
+                send_date = datetime.strptime(params['send_date'], '%Y-%m-%dT%H:%M:%S%z')
+            except:
+                raise ValueError('Bad format for send_date. Expected ISO 8601 or %Y-%m-%dT%H:%M:%S%z.')
+
+        return models.Message(created_at=send_date, to_originally=to, subject=params['subject'],
+                              msgbody=params['body'], email_uid=params.get('email_uid', ''),
+                              user_message_info=umi, user_id=umi.user_id)
+
+    @list_route(methods=['post'])
+    def send_batch(self, request):
+        """
+        Submits many messages at once, either as a list or as {"messages": [...]}. Messages are validated
+        together, the rate limit is checked once for the whole batch, legislators are resolved once per distinct
+        set of recipients, rows are created with bulk inserts and the messages are sent by grouped tasks.
+
+        The response has one result per submitted message, in order, with a status of 'queued',
+        'over_rate_limit', 'undeliverable' or 'invalid' (along with an error).
+        """
+        items = request.data.get('messages') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            raise exceptions.ValidationError('Expected a list of messages.')
+        if len(items) > self.max_batch_size:
+            raise exceptions.ValidationError('At most {0} messages can be sent at once.'.format(self.max_batch_size))
+
+        django_user = request.user
+        user = django_user.user
+        umi = user.default_info
+        if umi is None:
+            raise exceptions.ValidationError('User has no address information to send messages with.')
+
+        results = [None] * len(items)
+        msgs = []
+        for i, params in enumerate(items):
+            try:
+                msgs.append((i, self.build_message(params, umi)))
+            except ValueError as e:
+                results[i] = {'status': 'invalid', 'error': str(e)}
+
+        try:
+            permitted_legs = list(umi.members_of_congress)
+            # each message counts toward the rate limit of the ones after it
+            sent_count = user.recent_message_count()
+            max_per_interval = settings.CONFIG_DICT['email']['max_per_interval']
+            leg_buckets = {}
+            for n, (i, msg) in enumerate(msgs, 1):
+                msg.status = 'free' if sent_count + n <= max_per_interval else 'block'
+                recipients = tuple(msg.to_originally)
+                if recipients not in leg_buckets:
+                    leg_buckets[recipients] = models.Legislator.get_leg_buckets_from_emails(permitted_legs,
+                                                                                            msg.to_originally)
+
+            buckets = [leg_buckets[tuple(msg.to_originally)] for i, msg in msgs]
+            models.Message.create_batch([msg for i, msg in msgs], [b['contactable'] for b in buckets])
+            models.Message.queue_batch_to_send([msg for i, msg in msgs if msg.is_free_to_send() and msg.has_legislators])
+        except:
+            raise exceptions.APIException('Error while trying to submit emails.')
+
+        for (i, msg), bucket in zip(msgs, buckets):
+            send_status = None
+            try:
+                if msg.has_legislators and msg.is_free_to_send():
+                    send_status = 'queued'
+                    emailer.NoReply(django_user).message_queued(msg).send()
+                elif not msg.is_free_to_send():
+                    send_status = 'over_rate_limit'
+                    emailer.NoReply(django_user).over_rate_limit(msg).send()
+                else:
+                    send_status = 'undeliverable'
+                    if bucket['does_not_represent'] or bucket['non_existent']:
+                        emailer.NoReply(django_user).message_undeliverable(bucket, msg).send()
+                results[i] = {'data': self.serializer_class(msg).data, 'status': send_status}
+            except:
+                results[i] = {'data': self.serializer_class(msg).data, 'status': send_status,
+                              'error': traceback.format_exc()}
+
+        return Response({'results': results})
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from emailcongress.models import User, UserMessageInfo, Token, Legislator, MessageLegislator, Message
+from emailcongress.models import User, UserMessageInfo, Token, Legislator, MessageLegislator, Message, InboundMessage, \
+    OutboundEmail
 from django.contrib.auth.models import User as DjangoUser
 import abc
 
@@ -46,6 +47,20 @@ class MessageLegislatorAdmin(admin.ModelAdmin):
     pass
 
 
+class InboundMessageAdmin(AbstractAdmin):
+
+    list_display = ('id', 'message_id', 'status', 'processed_at')
+    list_filter = ('status',)
+    search_fields = ('message_id',)
+
+
+class OutboundEmailAdmin(AbstractAdmin):
+
+    list_display = ('id', 'to', 'status', 'attempts', 'error_code', 'error', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to', 'postmark_message_id')
+
+
 class DjangoUserAdmin(BaseUserAdmin):
 
     search_fields = ['email']
@@ -59,6 +74,8 @@ admin.site.register(Legislator, LegislatorAdmin)
 admin.site.register(Message, MessageAdmin)
 admin.site.register(UserMessageInfo, UserMessageInfoAdmin)
 admin.site.register(MessageLegislator, MessageLegislatorAdmin)
+admin.site.register(InboundMessage, InboundMessageAdmin)
+admin.site.register(OutboundEmail, OutboundEmailAdmin)
 
 admin.site.unregister(DjangoUser)
 admin.site.register(DjangoUser, DjangoUserAdmin)
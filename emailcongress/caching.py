@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+
+def _namespace_key(namespace):
+    return 'namespace-version:' + namespace
+
+
+def get_namespace_version(namespace):
+    """
+    Retrieves the current version of a cache namespace. Namespaces are used to invalidate groups of
+    cached values (e.g. everything derived from the legislator table) across all processes at once.
+
+    The version is seeded from the current time so that if the backend evicts the counter then it will not
+    restart at a version that stale values were written under.
+
+    @param namespace: name of the namespace
+    @type namespace: str
+    @return: current version of the namespace
+    @rtype: int
+    """
+    key = _namespace_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_namespace_version(namespace):
+    """
+    Increments the version of a cache namespace which invalidates every value stored under the old version.
+
+    @param namespace: name of the namespace
+    @type namespace: str
+    @return: the new version of the namespace
+    @rtype: int
+    """
+    key = _namespace_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # counter doesn't exist (never created or evicted) so seed a fresh one
+        cache.set(key, int(time.time() * 1000), timeout=None)
+        return cache.get(key, 0)
+
+
+class LRUCache(object):
+    """
+    Small thread safe in-process least recently used cache used in front of the shared cache backend.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError:
+                return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CacheStats(object):
+    """
+    Thread safe hit/miss counters for a cache. If a shared prefix is given then the counters are also kept in
+    the shared cache backend so that totals across every process can be reported.
+    """
+
+    def __init__(self, *counters, shared_prefix=None):
+        self.shared_prefix = shared_prefix
+        self._lock = threading.Lock()
+        self._counts = {name: 0 for name in counters}
+
+    def _shared_key(self, name):
+        return '{0}:{1}'.format(self.shared_prefix, name)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+        if self.shared_prefix is not None:
+            try:
+                cache.incr(self._shared_key(name), amount)
+            except ValueError:
+                cache.add(self._shared_key(name), amount, timeout=None)
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def shared_dict(self):
+        """
+        @return: counter totals across every process (empty if the counters aren't shared)
+        @rtype: dict[str, int]
+        """
+        if self.shared_prefix is None:
+            return {}
+        values = cache.get_many([self._shared_key(name) for name in self._counts])
+        return {name: values.get(self._shared_key(name), 0) for name in self._counts}
+
+    def reset(self):
+        with self._lock:
+            self._counts = {name: 0 for name in self._counts}
+        if self.shared_prefix is not None:
+            cache.delete_many([self._shared_key(name) for name in self._counts])
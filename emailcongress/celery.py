@@ -1,8 +1,9 @@
 from __future__ import absolute_import
 import os
-from celery import Celery
+from celery import Celery, chord
 from emailcongress import emailer
 from django.conf import settings
+from raven.contrib.django.raven_compat.models import client
 import traceback
 
 # set the default Django settings module for the 'celery' program.
@@ -43,3 +44,139 @@ def send_to_phantom_of_the_capitol(self, msg_id=None, msgleg_id=None, force=Fals
         except:
             raise Exception(traceback.format_exc())
             # TODO robust error handling
+
+
+@celery.task(bind=True, max_retries=celery.conf.MAX_RETRIES, default_retry_delay=celery.conf.RETRY_DELAY)
+def send_batch_to_phantom_of_the_capitol(self, msg_ids=None, force=False):
+    """
+    Sends a batch of messages with a single retrieval of form elements for all of their legislators. Messages
+    that aren't completely sent are retried together.
+
+    @param self:
+    @type self:
+    @param msg_ids: ids of the messages to send
+    @type msg_ids: list[int]
+    @param force:
+    @type force:
+    @return:
+    @rtype:
+    """
+    if settings.CONFIG_DICT['email']['submit_to_webform'] or force:
+        try:
+            from emailcongress.models import Message
+            unsent = []
+            for msg in Message.send_batch(Message.objects.filter(pk__in=msg_ids or [])):
+                if msg.get_send_status() == 'sent' or self.request.retries >= self.max_retries:
+                    emailer.NoReply(msg.user_message_info.user.django_user).send_status(msg.to_legislators, msg).send()
+                else:
+                    unsent.append(msg.id)
+            if unsent:
+                raise self.retry(kwargs={'msg_ids': unsent, 'force': force}, exc=Exception)
+        except:
+            raise Exception(traceback.format_exc())
+            # TODO robust error handling
+
+
+@celery.task(bind=True, max_retries=celery.conf.MAX_RETRIES, default_retry_delay=celery.conf.RETRY_DELAY)
+def send_message_legislator_to_phantom_of_the_capitol(self, msgleg_id=None, force=False):
+    """
+    Sends a message to a single legislator. Only this legislator is retried when the submission fails.
+
+    @param self:
+    @type self:
+    @param msgleg_id: id of the message legislator to send
+    @type msgleg_id: int
+    @param force:
+    @type force:
+    @return: whether the message was sent or None if submitting to webforms is disabled
+    @rtype: bool|None
+    """
+    if settings.CONFIG_DICT['email']['submit_to_webform'] or force:
+        from emailcongress.models import MessageLegislator
+        try:
+            msg_leg = MessageLegislator.objects.select_related('legislator', 'message').get(id=msgleg_id)
+            msg_leg.send()
+        except:
+            client.captureException()
+            msg_leg = None
+        if (msg_leg is None or not msg_leg.is_sent()) and self.request.retries < self.max_retries:
+            raise self.retry()
+        # never raise on the final attempt so the chord callback always runs
+        return msg_leg is not None and msg_leg.is_sent()
+
+
+@celery.task
+def send_status_to_user(results, msg_id=None):
+    """
+    Chord callback that emails the user the send status of a message once every legislator task has finished.
+
+    @param results: results of send_message_legislator_to_phantom_of_the_capitol
+    @type results: list[bool|None]
+    @param msg_id: id of the message
+    @type msg_id: int
+    """
+    if any(result is not None for result in results):
+        from emailcongress.models import Message
+        msg = Message.objects.get(pk=msg_id)
+        emailer.NoReply(msg.user_message_info.user.django_user).send_status(msg.to_legislators, msg).send()
+
+
+def queue_per_legislator(msg_id, msgleg_ids, force=False):
+    """
+    Enqueues one task per message legislator so a message's submissions spread across workers, with a chord
+    callback that sends the status email when they've all finished.
+
+    @param msg_id: id of the message
+    @type msg_id: int
+    @param msgleg_ids: ids of the message's legislators
+    @type msgleg_ids: list[int]
+    @param force: whether to submit even if submitting to webforms is disabled
+    @type force: bool
+    """
+    if msgleg_ids:
+        header = [send_message_legislator_to_phantom_of_the_capitol.s(msgleg_id=msgleg_id, force=force)
+                  for msgleg_id in msgleg_ids]
+        return chord(header)(send_status_to_user.s(msg_id=msg_id))
+
+
+@celery.task(bind=True, max_retries=celery.conf.MAX_RETRIES, default_retry_delay=celery.conf.RETRY_DELAY)
+def process_inbound_message(self, inbound_id=None):
+    """
+    Processes an inbound email that the Postmark webhook persisted without processing.
+
+    @param self:
+    @type self:
+    @param inbound_id: id of the InboundMessage to process
+    @type inbound_id: int
+    """
+    from emailcongress.models import InboundMessage
+    from emailcongress.views import PostmarkView
+    inbound = InboundMessage.objects.get(pk=inbound_id)
+    if inbound.status == 'processed':
+        return
+    try:
+        result = PostmarkView.process_inbound(inbound.payload)
+        inbound.mark('processed', result['status'])
+    except:
+        client.captureException()
+        inbound.mark('failed', traceback.format_exc())
+        if self.request.retries < self.max_retries:
+            raise self.retry()
+
+
+@celery.task
+def flush_outbound_email(batch_size=None, retries=0):
+    """
+    Sends queued outbound emails with Postmark's batch api.
+
+    @param batch_size: number of emails per Postmark call
+    @type batch_size: int
+    @param retries: number of consecutive flushes that couldn't reach Postmark before this one
+    @type retries: int
+    """
+    from services import outbound_mail_service
+    counts = outbound_mail_service.flush(batch_size=batch_size)
+    if counts['requeued']:
+        # postmark couldn't be reached so try the queued emails again later, backing off
+        outbound_mail_service.schedule_retry(retries)
+    return counts
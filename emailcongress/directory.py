@@ -0,0 +1,154 @@
+import threading
+import time
+
+from emailcongress import caching
+
+LEGISLATOR_NAMESPACE = 'legislators'
+
+
+class LegislatorDirectory(object):
+    """
+    Process-local index of the legislator table so that resolving inbound recipient addresses doesn't require
+    a database query per address. Every process holds its own copy which is rebuilt whenever the shared
+    legislator namespace version changes (see invalidate).
+    """
+
+    def __init__(self, check_interval=5):
+        """
+        @param check_interval: seconds between checks of the shared namespace version
+        @type check_interval: int|float
+        """
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+        self._checked_at = 0
+
+    @staticmethod
+    def normalize_email(email):
+        """
+        Normalizes an email address into the form used as a key in the directory.
+
+        @param email: email address of a legislator (legacy opencongress.org addresses are allowed)
+        @type email: str
+        @return: doctored and lowercased email
+        @rtype: str
+        """
+        from emailcongress.models import Legislator
+        return Legislator.doctor_email(email.strip()).lower()
+
+    def _build(self):
+        """
+        Loads every legislator with a single query and builds the lookup tables.
+
+        @return: dictionary of lookup tables
+        @rtype: dict[str, dict]
+        """
+        from emailcongress.models import Legislator
+
+        index = {'email': {}, 'bioguide_id': {}, 'district': {}}
+        for leg in Legislator.objects.order_by('pk'):
+            if leg.email:
+                index['email'].setdefault(self.normalize_email(leg.email), leg)
+            index['bioguide_id'][leg.bioguide_id] = leg
+            index['district'].setdefault((leg.state, leg.district), []).append(leg)
+        index['delegation'] = self._build_delegations(index['district'])
+        return index
+
+    @staticmethod
+    def _build_delegations(by_district):
+        """
+        Precomputes the members of congress of every district. A district is represented by the legislators of its
+        state without a district (senators) plus those of the district itself, ordered by title. The delegation of
+        (state, None) is just the former.
+
+        @param by_district: legislators keyed by (state, district) of their own constituency
+        @type by_district: dict[tuple, list]
+        @return: (state, district) to tuple of all members and tuple of contactable members
+        @rtype: dict[tuple, (tuple, tuple)]
+        """
+        delegations = {}
+        states = {state for state, district in by_district}
+        for state in states:
+            at_large = by_district.get((state, None), [])
+            districts = [district for s, district in by_district if s == state and district is not None]
+            for district in [None] + districts:
+                members = at_large + (by_district[(state, district)] if district is not None else [])
+                members = tuple(sorted(members, key=lambda leg: (leg.title, leg.pk)))
+                delegations[(state, district)] = (members, tuple(leg for leg in members if leg.contactable))
+        return delegations
+
+    def _current(self):
+        """
+        Returns the lookup tables, rebuilding them first if another process has changed the legislator table.
+
+        @return: dictionary of lookup tables
+        @rtype: dict[str, dict]
+        """
+        now = time.time()
+        index = self._index
+        if index is not None and now - self._checked_at < self.check_interval:
+            return index
+
+        version = caching.get_namespace_version(LEGISLATOR_NAMESPACE)
+        with self._lock:
+            if self._index is None or version != self._version:
+                # build fully before swapping so readers never see a partially built index
+                self._index = self._build()
+                self._version = version
+            self._checked_at = now
+            return self._index
+
+    @property
+    def version(self):
+        self._current()
+        return self._version
+
+    def invalidate(self):
+        """
+        Signals every process that the legislator table has changed so their directories are rebuilt.
+        """
+        caching.bump_namespace_version(LEGISLATOR_NAMESPACE)
+        with self._lock:
+            self._index = None
+
+    def find_by_email(self, email):
+        return self._current()['email'].get(self.normalize_email(email))
+
+    def find_by_bioguide_id(self, bioguide_id):
+        return self._current()['bioguide_id'].get(bioguide_id)
+
+    def find_by_district(self, state, district):
+        """
+        Finds the legislators whose own constituency is (state, district). Senators are stored with
+        a district of None.
+
+        @return: list of legislators
+        @rtype: list[emailcongress.models.Legislator]
+        """
+        return list(self._current()['district'].get((state, district), []))
+
+    def find_delegation(self, state, district, contactable=True):
+        """
+        Finds the members of congress representing a district, i.e. the same legislators as
+        Q(state=state) & (Q(district=None) | Q(district=district)) ordered by title, without a query.
+
+        @param state: two letter state abbreviation
+        @type state: str
+        @param district: congressional district number or None for only the legislators without a district
+        @type district: int|None
+        @param contactable: whether to leave out legislators that can't be contacted
+        @type contactable: bool
+        @return: list of legislators
+        @rtype: list[emailcongress.models.Legislator]
+        """
+        delegations = self._current()['delegation']
+        # a district without its own legislator is still represented by the state's senators
+        members = delegations.get((state, district)) or delegations.get((state, None), ((), ()))
+        return list(members[1] if contactable else members[0])
+
+    def all(self):
+        return list(self._current()['bioguide_id'].values())
+
+
+legislator_directory = LegislatorDirectory()
@@ -6,6 +6,7 @@ from postmark import PMMail
 from raven.contrib.django.raven_compat.models import client
 
 from emailcongress import utils
+from services import outbound_mail_service
 
 
 class NoReply(PMMail):
@@ -24,6 +25,10 @@ class NoReply(PMMail):
     def send(self, test=False):
         try:
             if not settings.DEBUG or (settings.DEBUG and self.to in settings.POSTMARK_DEBUG_EMAILS):
+                if not test and outbound_mail_service.outbound_config()['queue']:
+                    print('Queueing live email to ' + self.to)
+                    outbound_mail_service.enqueue(self)
+                    return True
                 print('Sending live email to ' + self.to)
                 return super().send(test=test)
             else:
@@ -71,7 +76,8 @@ class NoReply(PMMail):
         return self
 
     def remind_reps(self):
-        self.ctx['members_of_congress'] = self.user.members_of_congress
+        # the delegation is rendered from the fragment cache so members are only queried on a miss
+        self.ctx['umi'] = self.user.default_info
 
         self.subject = "Reminder of your members of Congress"
         self.html_body = render_to_string('emails/html_body/remind_reps.html', context=self.ctx)
@@ -98,7 +104,8 @@ class NoReply(PMMail):
         @param msg: the message object
         @type msg: emailcongress.models.Message
         """
-        self.ctx['members_of_congress'] = self.user.members_of_congress
+        # the delegation is rendered from the fragment cache so members are only queried on a miss
+        self.ctx['umi'] = self.user.default_info
 
         self.subject = 'You are successfully signed up for Email Congress!'
         self.html_body = render_to_string('emails/html_body/signup_success.html', context=self.ctx)
@@ -204,7 +211,8 @@ class NoReply(PMMail):
         """
         Handles the case of notifying a user when they've changed their address information.
         """
-        self.ctx['members_of_congress'] = self.user.members_of_congress
+        # the delegation is rendered from the fragment cache so members are only queried on a miss
+        self.ctx['umi'] = self.user.default_info
 
         self.subject = 'Your Email Congress contact information has changed.'
         self.html_body = render_to_string('emails/html_body/address_changed.html', context=self.ctx)
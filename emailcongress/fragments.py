@@ -0,0 +1,84 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from emailcongress.caching import LRUCache
+from emailcongress.directory import legislator_directory
+
+_local_cache = LRUCache(maxsize=settings.CONFIG_DICT['misc'].get('fragment_lru_size', 2048))
+
+
+def _cached(key, render):
+    """
+    Looks up a rendered fragment in the in-process LRU and then the shared cache before rendering it. Keys include
+    the legislator data version so every fragment is re-rendered after legislators are imported.
+
+    @param key: key of the fragment without the version
+    @type key: str
+    @param render: renders the fragment on a miss
+    @type render: callable
+    @return: the rendered fragment
+    @rtype: str
+    """
+    key = 'fragment:{0}:{1}'.format(legislator_directory.version, hashlib.sha1(key.encode('utf-8')).hexdigest())
+    fragment = _local_cache.get(key)
+    if fragment is None:
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = render()
+            cache.set(key, fragment, timeout=settings.CONFIG_DICT['misc'].get('fragment_cache_ttl', 60 * 60 * 24))
+        _local_cache.set(key, fragment)
+    return fragment
+
+
+def legislators(template_name, legs):
+    """
+    Renders a template that only depends on legislators, e.g. a contact link for one legislator.
+
+    @param template_name: template rendered with 'legislators' (and 'leg' for a single legislator) in its context
+    @type template_name: str
+    @param legs: a legislator or an iterable of legislators
+    @type legs: emailcongress.models.Legislator|iterable
+    @return: the rendered fragment
+    @rtype: django.utils.safestring.SafeText
+    """
+    legs = list(legs) if hasattr(legs, '__iter__') else [legs]
+    key = '{0}:{1}'.format(template_name, ','.join(leg.bioguide_id for leg in legs))
+    return mark_safe(_cached(key, lambda: render_to_string(template_name, context={
+        'legislators': legs, 'leg': legs[0] if len(legs) == 1 else None})))
+
+
+def delegation(template_name, umi):
+    """
+    Renders a template listing the members of congress for the district of a user's address. Most users share a
+    handful of delegations so the fragment is keyed by (state, district).
+
+    @param template_name: template rendered with 'legislators' in its context
+    @type template_name: str
+    @param umi: the user message info whose delegation to render
+    @type umi: emailcongress.models.UserMessageInfo
+    @return: the rendered fragment
+    @rtype: django.utils.safestring.SafeText
+    """
+    if umi.district is None:
+        # members_of_congress determines the district first
+        return mark_safe(render_to_string(template_name, context={'legislators': list(umi.members_of_congress)}))
+    key = '{0}:{1}:{2}'.format(template_name, umi.state, umi.district)
+    return mark_safe(_cached(key, lambda: render_to_string(template_name, context={
+        'legislators': list(umi.members_of_congress)})))
+
+
+def humanized_names(legs):
+    """
+    @param legs: legislators
+    @type legs: iterable
+    @return: full titles and names of the legislators joined into a humanized list
+    @rtype: str
+    """
+    from emailcongress.templatetags.emailcongress_filters import humanize_list
+    legs = list(legs)
+    return _cached('humanize:' + ','.join(leg.bioguide_id for leg in legs),
+                   lambda: humanize_list([leg.full_title_and_full_name for leg in legs]))
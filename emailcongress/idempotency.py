@@ -0,0 +1,70 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from emailcongress.models import IdempotencyKey
+
+
+class IdempotencyLedger(object):
+    """
+    Records ids that have been handled (e.g. Postmark message ids) as hashes with a unique index so concurrent
+    redeliveries can't both be processed.
+    """
+
+    def __init__(self, scope):
+        """
+        @param scope: namespace of the ids so the same id can be claimed once per kind of work
+        @type scope: str
+        """
+        self.scope = scope
+
+    def digest(self, ident):
+        return hashlib.sha1('{0}:{1}'.format(self.scope, ident).encode('utf-8')).hexdigest()
+
+    def claim(self, ident):
+        """
+        Claims an id by inserting its hash. The insert runs in a savepoint so that a redelivery hitting the unique
+        index doesn't break the surrounding transaction.
+
+        @param ident: id to claim
+        @type ident: str
+        @return: True if this call claimed the id, False if it had been claimed before
+        @rtype: bool
+        """
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(key_hash=self.digest(ident))
+            return True
+        except IntegrityError:
+            return False
+
+    def release(self, ident):
+        """
+        Releases a claimed id, e.g. when handling it failed and it should be handled again on redelivery.
+
+        @param ident: id to release
+        @type ident: str
+        """
+        IdempotencyKey.objects.filter(key_hash=self.digest(ident)).delete()
+
+
+def retention_cutoff():
+    return timezone.now() - timedelta(days=settings.CONFIG_DICT['misc'].get('idempotency_retention_days', 30))
+
+
+def expire_keys():
+    """
+    Deletes ledger entries older than misc.idempotency_retention_days.
+
+    @return: number of deleted entries
+    @rtype: int
+    """
+    return IdempotencyKey.objects.filter(created_at__lt=retention_cutoff()).delete()[0]
+
+
+# emails accepted by the webhook and emails processed into messages are claimed separately
+postmark_ingest_ledger = IdempotencyLedger('postmark-ingest')
+postmark_inbound_ledger = IdempotencyLedger('postmark-inbound')
@@ -14,6 +14,7 @@ from django.conf import settings
 from raven.contrib.django.raven_compat.models import client
 
 from emailcongress.models import *
+from emailcongress import utils
 from emailcongress.utils import construct_link
 
 
@@ -66,8 +67,9 @@ def create_test_data():
         # umi2 = user_message_info(user=user2)
         # msg2 = message(umi=umi2)
 
-        for i in list(range(0,100)):
-            user(email=(''.join(random.choice(string.ascii_lowercase) for _ in range(10)))+'@example.com')
+        with HasTokenMixin.deferred_tokens():
+            for i in list(range(0,100)):
+                user(email=(''.join(random.choice(string.ascii_lowercase) for _ in range(10)))+'@example.com')
 
         admin1 = admin_user()
 
@@ -128,6 +130,57 @@ def reset_tos(from_email=None):
         print('User with email ' + from_email + ' does not exist.')
 
 
+def reprocess_inbound(status='failed'):
+    """
+    Queues persisted inbound emails with the given status (e.g. pending ones whose task was lost) to be processed again.
+    """
+    inbound = InboundMessage.objects.filter(status=status).order_by('id')
+    for inbound_message in inbound:
+        inbound_message.queue_to_process()
+    print('Queued {0} {1} inbound messages'.format(len(inbound), status))
+
+
+def flush_outbound_email(batch_size=None):
+    from services import outbound_mail_service
+    print(outbound_mail_service.flush(batch_size=batch_size))
+
+
+def requeue_failed_outbound_email(include_rejected=False):
+    """
+    Queues outbound emails that failed to send (by default only those Postmark didn't reject individually) and
+    flushes the queue.
+    """
+    from services import outbound_mail_service
+    print('Queued {0} failed emails'.format(outbound_mail_service.requeue_failed(
+        include_rejected=utils.bool_eval(include_rejected))))
+    print(outbound_mail_service.flush())
+
+
+def mint_missing_tokens(batch_size=1000):
+    """
+    Creates tokens for every user and message that doesn't have one, e.g. after an import with the token trigger
+    disconnected.
+    """
+    for model in [User, Message]:
+        created = Token.objects.bulk_mint(model.objects.only('id').iterator(), batch_size=int(batch_size))
+        print('Created {0} tokens for {1}'.format(created, model.__name__))
+
+
+def geocode_cache_stats(reset=False):
+    from services import geolocation_service
+    for name, count in sorted(geolocation_service.cache_stats().items()):
+        print('{0}: {1}'.format(name, count))
+    if utils.bool_eval(reset):
+        geolocation_service.stats.reset()
+        print('Counters reset.')
+
+
+def clear_form_elements_cache():
+    from services import phantom_service
+    phantom_service.invalidate_form_elements()
+    print('Cleared cached phantom of the capitol form elements.')
+
+
 class Command(BaseCommand):
     help = 'Run admin tasks for development and management.'
     tasks = {
@@ -135,7 +188,13 @@ class Command(BaseCommand):
         'create_test_data': create_test_data,
         'setup_test_environment': setup_test_environment,
         'simulate_postmark_message': simulate_postmark_message,
-        'reset_tos': reset_tos
+        'reset_tos': reset_tos,
+        'mint_missing_tokens': mint_missing_tokens,
+        'reprocess_inbound': reprocess_inbound,
+        'flush_outbound_email': flush_outbound_email,
+        'requeue_failed_outbound_email': requeue_failed_outbound_email,
+        'geocode_cache_stats': geocode_cache_stats,
+        'clear_form_elements_cache': clear_form_elements_cache
     }
 
     def add_arguments(self, parser):
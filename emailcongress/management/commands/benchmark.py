@@ -0,0 +1,227 @@
+import os
+import random
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+
+from emailcongress import utils
+from emailcongress.models import Token, User, Message, UserMessageInfo, DjangoUser
+from lib.usps import USPSScraper
+from services import determine_district_service
+
+USPS_FIXTURE = os.path.join('data', 'fixtures', 'usps_zip_lookup_results.html')
+
+
+def _report(name, count, elapsed):
+    print('{0}: {1} iterations in {2:.3f}s ({3:,.0f}/s)'.format(name, count, elapsed, count / elapsed if elapsed else 0))
+
+
+def district_lookup(points=100000, seed=0):
+    """
+    Measures lookups per second of the local district boundary engine over the configured boundary files.
+
+    @param points: number of random points to look up
+    @type points: int
+    @param seed: random seed so runs are comparable
+    @type seed: int
+    """
+    start = time.time()
+    engine = determine_district_service.district_boundaries()
+    if engine is None:
+        raise CommandError('No district boundaries found at paths.district_boundaries.')
+    print('Loaded {0} districts ({1} polygons) in {2:.2f}s'.format(len(engine), len(engine.polygons),
+                                                                   time.time() - start))
+
+    # sample points from the bounding boxes of random polygons so most points fall within a district
+    rng = random.Random(int(seed))
+    samples = []
+    for i in range(int(points)):
+        bbox = rng.choice(engine.polygons)[2]
+        samples.append((rng.uniform(bbox[1], bbox[3]), rng.uniform(bbox[0], bbox[2])))
+
+    hits = 0
+    start = time.time()
+    for lat, lng in samples:
+        if engine.lookup(lat, lng) is not None:
+            hits += 1
+    _report('district_lookup', len(samples), time.time() - start)
+    print('{0} of {1} points resolved to a district'.format(hits, len(samples)))
+
+
+def usps_parser(iterations=500, chunk_size=8192):
+    """
+    Compares the BeautifulSoup and targeted streaming parsers of USPS zip lookup results against a saved
+    results page so parser regressions can be caught offline.
+
+    @param iterations: number of times to parse the page with each parser
+    @type iterations: int
+    @param chunk_size: size of the chunks fed to the streaming parser, like requests' iter_content
+    @type chunk_size: int
+    """
+    with open(os.path.join(settings.BASE_DIR, USPS_FIXTURE), mode='r') as f:
+        html = f.read()
+    iterations, chunk_size = int(iterations), int(chunk_size)
+    chunks = [html[i:i + chunk_size].encode('utf-8') for i in range(0, len(html), chunk_size)]
+
+    expected = USPSScraper.parse_results_soup(html)
+    if USPSScraper.parse_results_targeted(chunks) != expected:
+        raise CommandError('Targeted parser disagrees with BeautifulSoup parser: {0}'.format(expected))
+
+    timings = {}
+    for name, parse, page in [('soup', USPSScraper.parse_results_soup, html),
+                              ('targeted', USPSScraper.parse_results_targeted, chunks)]:
+        start = time.time()
+        for i in range(iterations):
+            parse(page)
+        timings[name] = time.time() - start
+        _report('usps_parser[{0}]'.format(name), iterations, timings[name])
+    print('targeted parser is {0:.1f}x faster'.format(timings['soup'] / timings['targeted']))
+
+
+def api_auth(key=None, iterations=1000, max_queries=1):
+    """
+    Measures API token authentication with a cold and a warm credential cache and counts the queries a warm
+    authentication makes. Without a key the token of the first user with API access is used.
+
+    @param key: token key to authenticate with
+    @type key: str
+    @param iterations: number of authentications to time
+    @type iterations: int
+    @param max_queries: fail if a warm authentication takes more queries than this
+    @type max_queries: int
+    """
+    from rest_framework.exceptions import AuthenticationFailed
+    from api.authenticators import TokenAuthentication
+
+    if key is None:
+        user = User.objects.filter(Q(django_user__is_superuser=True) |
+                                   Q(django_user__user_permissions__codename='api') |
+                                   Q(django_user__groups__permissions__codename='api')).order_by('id').first()
+        if user is None:
+            raise CommandError('No user has API access. Pass a token key with --kwargs key=...')
+        key = user.token_key
+
+    iterations = int(iterations)
+    authenticator = TokenAuthentication()
+    try:
+        for name, clear in [('cold', True), ('warm', False)]:
+            authenticator.authenticate_credentials(key)
+            start = time.time()
+            for i in range(iterations):
+                if clear:
+                    Token.uncache_key(key)
+                authenticator.authenticate_credentials(key)
+            _report('api_auth[{0}]'.format(name), iterations, time.time() - start)
+    except AuthenticationFailed as e:
+        raise CommandError('Token {0} failed to authenticate: {1}'.format(key, e))
+
+    with CaptureQueriesContext(connection) as ctx:
+        authenticator.authenticate_credentials(key)
+    print('warm authentication: {0} queries'.format(len(ctx.captured_queries)))
+    if len(ctx.captured_queries) > int(max_queries):
+        raise CommandError('Authentication took {0} queries, expected at most {1}:\n{2}'.format(
+            len(ctx.captured_queries), max_queries, '\n'.join(q['sql'] for q in ctx.captured_queries)))
+
+
+def _synthesize_messages(messages, users, infos_per_user, rng, batch_size=10000):
+    prefix = uuid.uuid4().hex[:8]
+    DjangoUser.objects.bulk_create([DjangoUser(username='{0}-{1}'.format(prefix, i),
+                                               email='{0}-{1}@example.com'.format(prefix, i)) for i in range(users)],
+                                   batch_size=batch_size)
+    django_user_ids = DjangoUser.objects.filter(username__startswith=prefix + '-').values_list('id', flat=True)
+    User.objects.bulk_create([User(django_user_id=i) for i in django_user_ids], batch_size=batch_size)
+    user_ids = list(User.objects.filter(django_user__username__startswith=prefix + '-').values_list('id', flat=True))
+
+    # users accumulate infos because every address change clones one
+    UserMessageInfo.objects.bulk_create([UserMessageInfo(user_id=user_id, default=(i == infos_per_user - 1))
+                                         for user_id in user_ids for i in range(infos_per_user)],
+                                        batch_size=batch_size)
+    infos = list(UserMessageInfo.objects.filter(user_id__in=user_ids).values_list('id', 'user_id'))
+
+    now = timezone.now()
+    with utils.preserve_timestamps(Message):
+        for start in range(0, messages, batch_size):
+            batch = []
+            for i in range(start, min(start + batch_size, messages)):
+                umi_id, user_id = rng.choice(infos)
+                created_at = now - timedelta(seconds=rng.randint(0, 60 * 60 * 24 * 365))
+                batch.append(Message(user_message_info_id=umi_id, user_id=user_id, created_at=created_at,
+                                     updated_at=created_at, to_originally=[], subject='benchmark', msgbody='',
+                                     email_uid=''))
+            Message.objects.bulk_create(batch)
+    return user_ids
+
+
+def user_messages(messages=1000000, users=20000, infos_per_user=3, samples=500, seed=0):
+    """
+    Compares per user message queries through user message infos with the denormalized, indexed Message.user on
+    a synthetic dataset. The dataset is created inside a transaction that is rolled back at the end.
+
+    @param messages: number of synthetic messages
+    @type messages: int
+    @param users: number of synthetic users
+    @type users: int
+    @param infos_per_user: number of user message infos per user
+    @type infos_per_user: int
+    @param samples: number of users to run the queries for
+    @type samples: int
+    @param seed: random seed so runs are comparable
+    @type seed: int
+    """
+    rng = random.Random(int(seed))
+    with transaction.atomic():
+        start = time.time()
+        user_ids = _synthesize_messages(int(messages), int(users), int(infos_per_user), rng)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE ' + connection.ops.quote_name(Message._meta.db_table))
+        print('Created {0} messages for {1} users in {2:.1f}s'.format(messages, users, time.time() - start))
+
+        sample = [User.objects.get(pk=user_id) for user_id in rng.sample(user_ids, min(int(samples), len(user_ids)))]
+        since = timezone.now() - timedelta(hours=settings.CONFIG_DICT['email']['interval_hour_max'])
+        queries = {
+            'through infos': lambda user: Message.objects.filter(
+                user_message_info__in=user.usermessageinfo_set.all()).order_by('created_at'),
+            'by user': lambda user: user.messages()
+        }
+        for name, query in sorted(queries.items()):
+            start = time.time()
+            for user in sample:
+                query(user).last()
+                query(user).filter(created_at__gte=since).count()
+            _report('user_messages[{0}]'.format(name), len(sample), time.time() - start)
+
+        transaction.set_rollback(True)
+
+
+class Command(BaseCommand):
+    help = 'Run performance benchmarks.'
+    tasks = {
+        'api_auth': api_auth,
+        'district_lookup': district_lookup,
+        'user_messages': user_messages,
+        'usps_parser': usps_parser
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('task', type=str)
+        parser.add_argument('--kwargs', type=lambda kv: kv.split("="), dest='kwargs', nargs='*', default=[])
+
+    def handle(self, **options):
+        try:
+            task = options.pop('task')
+            print('Running {0}'.format(task))
+            self.tasks.get(task)(**{item[0]: item[1] for item in options['kwargs']})
+        except CommandError:
+            raise
+        except:
+            print(traceback.format_exc())
+            raise CommandError("Must supply a valid benchmark from " + str(self.tasks.keys()))
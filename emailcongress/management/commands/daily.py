@@ -3,27 +3,123 @@ from emailcongress import utils
 import requests
 import json
 import traceback
+from concurrent import futures
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
 
 from emailcongress.models import Legislator
+from emailcongress.directory import legislator_directory
+from services import phantom_service
 from django.conf import settings
 
 
-def import_congresspeople(from_cache=False):
+def fetch_legislators(bioguide_ids, batch_size=50, max_workers=8):
     """
+    Retrieves legislator records from the congress api. Ids are requested in batches with the api's multi-id
+    filter and the batches are requested concurrently.
 
-    @param from_cache:
-    @type from_cache:
-    @return:
-    @rtype:
+    @param bioguide_ids: bioguide ids of the legislators to retrieve
+    @type bioguide_ids: list[str]
+    @param batch_size: number of ids per request (the api returns at most 50 results per page)
+    @type batch_size: int
+    @param max_workers: maximum number of concurrent requests
+    @type max_workers: int
+    @return: legislator records keyed by bioguide id
+    @rtype: dict[str, dict]
     """
-    if from_cache:  # load members of congress from cache (to speed up testing/development)
-        with open(os.path.join(settings.BASE_DIR, settings.CONFIG_DICT['paths']['legislator_data_cache']), mode='r') as cache:
-            data = json.load(cache)
-            for leg in data:
-                fields = {k: v for k, v in leg.items() if k in Legislator.CONGRESS_API_COLUMNS}
-                Legislator.objects.get_or_create(**fields)
+    def fetch(batch):
+        r = requests.get(settings.CONFIG_DICT['api_endpoints']['congress_base'] + '/legislators',
+                         params={'bioguide_id__in': '|'.join(batch), 'per_page': len(batch),
+                                 'apikey': settings.CONFIG_DICT['api_keys']['sunlight']}, timeout=30)
+        return r.json()['results']
+
+    records = {}
+    batches = [bioguide_ids[i:i + batch_size] for i in range(0, len(bioguide_ids), batch_size)]
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch, future in [(batch, executor.submit(fetch, batch)) for batch in batches]:
+            try:
+                for data in future.result():
+                    records[data['bioguide_id']] = data
+            except:
+                print("No data from congress api for : " + ', '.join(batch))
+                # TODO report
+    return records
+
+
+def sync_legislators(records, contactable_ids):
+    """
+    Diffs legislator records against the database. New legislators are inserted with one query and only the
+    changed columns of existing legislators are updated. Every record is synced in its own savepoint so a
+    malformed record is reported and skipped instead of rolling back the others.
+
+    @param records: legislator records from the congress api (or the legislator data cache)
+    @type records: list[dict]
+    @param contactable_ids: bioguide ids of the legislators phantom of the capitol can contact
+    @type contactable_ids: set[str]
+    @return: counts of added, changed, unchanged and failed legislators
+    @rtype: dict[str, int]
+    """
+    existing = {leg.bioguide_id: leg for leg in Legislator.objects.all()}
+    counts = {'added': 0, 'changed': 0, 'unchanged': 0, 'failed': 0}
+    new = []
+    now = timezone.now()
+    with transaction.atomic():
+        for data in records:
+            try:
+                with transaction.atomic():
+                    fields = {attr: data.get(attr, '') for attr in Legislator.CONGRESS_API_COLUMNS}
+                    fields['email'] = data['email']
+                    fields['contactable'] = fields['bioguide_id'] in contactable_ids
+                    leg = existing.get(fields['bioguide_id'])
+                    if leg is None:
+                        new.append(Legislator(**fields))
+                        continue
+                    changed = {attr: value for attr, value in fields.items() if getattr(leg, attr) != value}
+                    if changed:
+                        Legislator.objects.filter(pk=leg.pk).update(updated_at=now, **changed)
+                        counts['changed'] += 1
+                    else:
+                        counts['unchanged'] += 1
+            except KeyboardInterrupt:
+                raise
+            except:
+                print("Unable to sync legislator : {0}".format(data.get('bioguide_id')))
+                counts['failed'] += 1
+
+        try:
+            with transaction.atomic():
+                Legislator.objects.bulk_create(new)
+            counts['added'] = len(new)
+        except KeyboardInterrupt:
+            raise
+        except:
+            # one bad row fails the whole insert so find it by inserting them one at a time
+            for leg in new:
+                try:
+                    with transaction.atomic():
+                        leg.save()
+                    counts['added'] += 1
+                except KeyboardInterrupt:
+                    raise
+                except:
+                    print("Unable to add legislator : {0}".format(leg.bioguide_id))
+                    counts['failed'] += 1
+    return counts
+
+
+def import_congresspeople(from_cache=False, max_workers=8):
+    """
+    Imports contactable legislators from the congress api (or the legislator data cache) and updates only those
+    that changed.
+
+    @param from_cache: load legislators from the legislator data cache instead of the congress api
+    @type from_cache: bool
+    @param max_workers: maximum number of concurrent congress api requests
+    @type max_workers: int
+    """
+    from_cache = utils.bool_eval(from_cache)
 
     # get all contactable reps from the phantom of the capitol database
     contactable = requests.get(settings.CONFIG_DICT['api_endpoints']['phantom_base'] + '/list-congress-members',
@@ -32,40 +128,52 @@ def import_congresspeople(from_cache=False):
     # collect contactable reps bioguides
     bioguide_ids = [x['bioguide_id'] for x in contactable.json()]
 
-    # marks those for whom we don't have a contact-congress yaml as uncontactable
-    Legislator.objects.exclude(bioguide_id__in=bioguide_ids).update(contactable=False)
-
-    if not utils.bool_eval(from_cache):
-        # Create legislator entry for congresspeople for whom we don't have a database entry
+    if from_cache:  # load members of congress from cache (to speed up testing/development)
+        with open(os.path.join(settings.BASE_DIR, settings.CONFIG_DICT['paths']['legislator_data_cache']), mode='r') as cache:
+            all_legislators = json.load(cache)
+    else:
+        records = fetch_legislators(bioguide_ids, max_workers=int(max_workers))
         all_legislators = []
         for bgi in bioguide_ids:
-            leg = Legislator.objects.get_or_instantiate(bioguide_id=bgi)
-            try:
-                r = requests.get(settings.CONFIG_DICT['api_endpoints']['congress_base'] + '/legislators',
-                                 params={'bioguide_id': bgi, 'apikey': settings.CONFIG_DICT['api_keys']['sunlight']})
-                data = r.json()['results'][0]
-                data['email'] = Legislator.doctor_email(data.get('oc_email', ''))
-                for attr in Legislator.CONGRESS_API_COLUMNS:
-                    setattr(leg, attr, data.get(attr, ''))
-                leg.email = data['email']
-                leg.save()
-                all_legislators.append(data)
-            except KeyboardInterrupt:
-                pass
-            except:
+            if bgi not in records:
                 print("No data from congress api for : " + bgi)
-                # TODO report
                 continue
+            data = records[bgi]
+            data['email'] = Legislator.doctor_email(data.get('oc_email', '') or '')
+            all_legislators.append(data)
 
         # save data to cache in case we need to load it up again
         with open(os.path.join(settings.BASE_DIR, settings.CONFIG_DICT['paths']['legislator_data_cache']), mode='w') as cache:
             json.dump(all_legislators, cache, indent=4)
 
+    counts = sync_legislators(all_legislators, set(bioguide_ids))
+
+    # marks those for whom we don't have a contact-congress yaml as uncontactable
+    counts['uncontactable'] = Legislator.objects.exclude(bioguide_id__in=bioguide_ids) \
+        .filter(contactable=True).update(contactable=False, updated_at=timezone.now())
+
+    print('Legislators added: {added}, changed: {changed}, unchanged: {unchanged}, failed: {failed}, '
+          'newly uncontactable: {uncontactable}'.format(**counts))
+
+    # queryset updates above bypass the post_save signal so rebuild legislator directories explicitly
+    legislator_directory.invalidate()
+    # contact forms may have changed along with the legislators
+    phantom_service.invalidate_form_elements()
+
+
+def expire_idempotency_keys():
+    """
+    Deletes idempotency ledger entries older than the retention window.
+    """
+    from emailcongress import idempotency
+    print('Expired {0} idempotency keys'.format(idempotency.expire_keys()))
+
 
 class Command(BaseCommand):
     help = 'Run daily tasks.'
     tasks = {
-        'import_congresspeople': import_congresspeople
+        'import_congresspeople': import_congresspeople,
+        'expire_idempotency_keys': expire_idempotency_keys
     }
 
     def add_arguments(self, parser):
@@ -1,5 +1,6 @@
 import os
 import json
+import time
 import traceback
 from datetime import datetime
 from django.utils import timezone
@@ -7,89 +8,340 @@ from django.utils import timezone
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import signals
+from django.db import connection, transaction
+from django.db.models import Max
 
-from emailcongress import models
+from emailcongress import models, utils
+
+def iter_export(f, chunk_size=1 << 16):
+    """
+    Streams the rows of a phantom mask export, a JSON object mapping each section name to a list of JSON encoded
+    rows, without loading the whole file into memory.
+
+    @param f: the open export file
+    @type f: file
+    @param chunk_size: number of characters to read at a time
+    @type chunk_size: int
+    @return: generator of (section name, decoded row)
+    @rtype: generator
+    """
+    decoder = json.JSONDecoder()
+    state = {'buf': '', 'pos': 0, 'eof': False}
+
+    def fill():
+        if state['eof']:
+            raise ValueError('Unexpected end of export file')
+        data = f.read(chunk_size)
+        state['buf'] = state['buf'][state['pos']:] + data
+        state['pos'] = 0
+        state['eof'] = not data
+
+    def peek():
+        while True:
+            buf, pos = state['buf'], state['pos']
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            state['pos'] = pos
+            if pos < len(buf):
+                return buf[pos]
+            fill()
+
+    def expect(chars):
+        char = peek()
+        if char not in chars:
+            raise ValueError('Expected one of {0} but found {1!r} in export file'.format(chars, char))
+        state['pos'] += 1
+        return char
+
+    def value():
+        peek()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(state['buf'], state['pos'])
+                # a value running up to the end of the buffer may be truncated (e.g. a number)
+                if end < len(state['buf']) or state['eof']:
+                    state['pos'] = end
+                    return obj
+            except ValueError:
+                if state['eof']:
+                    raise
+            fill()
+
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        section = value()
+        expect(':')
+        expect('[')
+        if peek() != ']':
+            while True:
+                row = value()
+                yield section, json.loads(row) if isinstance(row, str) else row
+                if expect(',]') == ']':
+                    break
+        else:
+            expect(']')
+        if expect(',}') == '}':
+            return
+
+
+def _aware(value, fmt):
+    return timezone.make_aware(datetime.strptime(value, fmt)) if value else None
+
+
+# sections in the order they have to be loaded for their references to resolve
+SECTIONS = ['User', 'UserMessageInfo', 'Message', 'MessageLegislator', 'Token']
+# sections whose phantom mask ids are shifted into a block of ids reserved in this database
+OFFSET_SECTIONS = ['UserMessageInfo', 'Message', 'MessageLegislator']
+
+
+def check_section_order(previous, section):
+    if section not in SECTIONS:
+        raise ValueError('Unknown section {0} in export file'.format(section))
+    if previous is not None and SECTIONS.index(section) <= SECTIONS.index(previous):
+        raise ValueError('Section {0} follows {1} in export file but sections must be in the order {2}'.format(
+            section, previous, ', '.join(SECTIONS)))
+
+
+class Loader(object):
+    """
+    Loads a phantom mask export in batches. Every batch is written with bulk_create inside its own transaction and
+    the number of rows committed per section is written to a checkpoint file so that an interrupted load can be
+    resumed from the last committed batch.
+
+    User message infos, messages and message legislators get their phantom mask id plus an offset so rows can
+    reference each other without a lookup. The offsets are reserved from the id sequences before loading and kept
+    in the checkpoint, so a resumed load maps every row to the same id and skips rows a batch already committed
+    before its checkpoint was written. Users are matched up by email because their django users may already exist.
+    The rows a batch references are looked up for that batch only, so memory doesn't grow with the size of the tables.
+    """
+
+    def __init__(self, checkpoint_path, batch_size=1000):
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.checkpoint = {'rows': {}, 'offsets': {}}
+        self.user_map = {}  # phantom mask user id -> User.id
+        self.legislators = dict(models.Legislator.objects.values_list('bioguide_id', 'id'))
+        self.ctypes = {name.lower(): ContentType.objects.get_for_model(getattr(models, name))
+                       for name in ['User', 'Message']}
+        self.related = {}  # ids referenced by the current batch, see lookup_related
+        self.start = time.time()
+        self.rows = 0
+
+    def load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r') as f:
+                self.checkpoint = json.load(f)
+            print('Resuming from checkpoint {0}'.format(self.checkpoint))
+
+    @staticmethod
+    def reserve_block(model_class, size):
+        """
+        Reserves a block of ids after the ones in use.
+
+        @return: offset to add to ids from 1 to size
+        @rtype: int
+        """
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # ids handed out by the sequence from now on are past the block
+                sequence = "pg_get_serial_sequence(%s, %s)"
+                cursor.execute("SELECT setval({0}, nextval({0}) + %s)".format(sequence),
+                               [model_class._meta.db_table, model_class._meta.pk.column] * 2 + [size])
+                return cursor.fetchone()[0] - size
+        return model_class.objects.aggregate(Max('id'))['id__max'] or 0
+
+    def reserve_ids(self, f):
+        """
+        Checks the order of the export's sections and reserves a block of ids for every section that keeps its ids.
+
+        @param f: the open export file
+        @type f: file
+        """
+        section, max_ids = None, {}
+        for row_section, row in iter_export(f):
+            if row_section != section:
+                check_section_order(section, row_section)
+                section = row_section
+            if section in OFFSET_SECTIONS:
+                max_ids[section] = max(max_ids.get(section, 0), row['id'])
+        for section in OFFSET_SECTIONS:
+            self.checkpoint['offsets'][section] = self.reserve_block(getattr(models, section), max_ids.get(section, 0))
+        self.save_checkpoint()
+        print('Reserved ids with offsets {0}'.format(self.checkpoint['offsets']))
+
+    def new_id(self, section, old_id):
+        return old_id + self.checkpoint['offsets'][section] if old_id is not None else None
+
+    def save_checkpoint(self):
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def lookup_related(self, section, rows):
+        """
+        Looks up the rows of earlier sections that a batch references.
+
+        @return: for messages their user message info ids mapped to user ids, for message legislators their
+                 message ids that exist, otherwise empty
+        @rtype: dict
+        """
+        if section == 'Message':
+            ids = {self.new_id('UserMessageInfo', row.get('user_message_info_id')) for row in rows}
+            ids.discard(None)
+            return dict(models.UserMessageInfo.objects.filter(id__in=ids).values_list('id', 'user_id'))
+        if section == 'MessageLegislator':
+            ids = {self.new_id('Message', row.get('message_id')) for row in rows}
+            ids.discard(None)
+            return dict.fromkeys(models.Message.objects.filter(id__in=ids).values_list('id', flat=True))
+        return {}
+
+    def build_usermessageinfo(self, row):
+        if self.user_map.get(row.get('user_id')) is None:
+            return None
+        row['id'] = self.new_id('UserMessageInfo', row['id'])
+        row['user_id'] = self.user_map[row['user_id']]
+        row['created_at'] = row['updated_at'] = _aware(row['created_at'], "%Y-%m-%dT%H:%M:%S.%f")
+        row['accept_tos'] = _aware(row['accept_tos'], "%Y-%m-%dT%H:%M:%S.%f")
+        row['district'] = row['district'] or None
+        return models.UserMessageInfo(**row)
+
+    def build_message(self, row):
+        row['id'] = self.new_id('Message', row['id'])
+        row['user_message_info_id'] = self.new_id('UserMessageInfo', row.get('user_message_info_id'))
+        if row['user_message_info_id'] not in self.related:
+            print(row)
+            return None
+        row['user_id'] = self.related[row['user_message_info_id']]
+        row['created_at'] = row['updated_at'] = _aware(row['created_at'], "%Y-%m-%dT%H:%M:%S")
+        return models.Message(**row)
+
+    def build_messagelegislator(self, row):
+        row['id'] = self.new_id('MessageLegislator', row['id'])
+        row['message_id'] = self.new_id('Message', row.get('message_id'))
+        if row['message_id'] not in self.related:
+            print(row)
+            return None
+        row.pop('topic_id', None)
+        row['legislator_id'] = self.legislators.get(row['legislator_id'])
+        row['sent'] = row['sent'] or None
+        return models.MessageLegislator(**row)
+
+    def build_token(self, row):
+        table = row['item_table'].lower()
+        object_id = self.user_map.get(row['item_id']) if table == 'user' else self.new_id('Message', row['item_id'])
+        if table not in self.ctypes or object_id is None:
+            print(row)
+            return None
+        return models.Token(key=row['token'], object_id=object_id, content_type=self.ctypes[table])
+
+    def write_users(self, rows):
+        emails = {row['email']: row['id'] for row in rows}
+        existing = dict(models.DjangoUser.objects.filter(email__in=emails).values_list('email', 'id'))
+        models.DjangoUser.objects.bulk_create([models.DjangoUser(username=email[0:30], email=email)
+                                               for email in emails if email not in existing])
+        django_users = dict(models.DjangoUser.objects.filter(email__in=emails).values_list('email', 'id'))
+        users = dict(models.User.objects.filter(django_user_id__in=django_users.values())
+                     .values_list('django_user_id', 'id'))
+        models.User.objects.bulk_create([models.User(django_user_id=django_user_id)
+                                         for django_user_id in django_users.values() if django_user_id not in users])
+        self.map_users(rows)
+
+    def map_users(self, rows):
+        users = dict(models.User.objects.filter(django_user__email__in=[row['email'] for row in rows])
+                     .values_list('django_user__email', 'id'))
+        for row in rows:
+            self.user_map[row['id']] = users.get(row['email'])
+
+    def write(self, section, rows):
+        if section == 'User':
+            return self.write_users(rows)
+        self.related = self.lookup_related(section, rows)
+        objs = [obj for obj in (getattr(self, 'build_' + section.lower())(row) for row in rows) if obj is not None]
+        model_class = getattr(models, section)
+        # rows committed by a batch whose checkpoint wasn't written before the load was interrupted
+        if section == 'Token':
+            existing = set(model_class.objects.filter(key__in=[obj.key for obj in objs]).values_list('key', flat=True))
+            objs = [obj for obj in objs if obj.key not in existing]
+        else:
+            existing = set(model_class.objects.filter(id__in=[obj.id for obj in objs]).values_list('id', flat=True))
+            objs = [obj for obj in objs if obj.id not in existing]
+        model_class.objects.bulk_create(objs)
+
+    def flush(self, section, rows, committed):
+        with transaction.atomic():
+            self.write(section, rows)
+        self.checkpoint['rows'][section] = committed
+        self.save_checkpoint()
+        self.rows += len(rows)
+        elapsed = time.time() - self.start
+        print('{0}: {1} rows committed ({2:,.0f} rows/s overall)'.format(section, committed,
+                                                                      self.rows / elapsed if elapsed else 0))
+
+    def end_section(self, section, batch, skipped, seen):
+        if skipped:
+            self.map_users(skipped)
+        if batch:
+            self.flush(section, batch, seen)
+
+    def run(self, f):
+        section, seen, batch, skipped = None, 0, [], []
+        for row_section, row in iter_export(f):
+            if row_section != section:
+                check_section_order(section, row_section)
+                self.end_section(section, batch, skipped, seen)
+                section, seen, batch, skipped = row_section, 0, [], []
+            seen += 1
+            if seen <= self.checkpoint['rows'].get(section, 0):
+                # committed by a previous run so only the user id mapping has to be rebuilt
+                if section == 'User':
+                    skipped.append(row)
+                    if len(skipped) >= self.batch_size:
+                        self.map_users(skipped)
+                        skipped = []
+                continue
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.flush(section, batch, seen)
+                batch = []
+        self.end_section(section, batch, skipped, seen)
+
+    def finish(self):
+        for model_class in [models.User, models.Message]:
+            created = models.Token.objects.bulk_mint(model_class.objects.only('id').iterator(),
+                                                     batch_size=self.batch_size)
+            if created:
+                print('Created {0} missing tokens for {1}'.format(created, model_class.__name__))
 
 
 class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('datafile', type=str)
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=1000)
+        parser.add_argument('--checkpoint', type=str, dest='checkpoint', default=None,
+                            help='Checkpoint file, defaults to the data file with .checkpoint appended.')
+        parser.add_argument('--restart', action='store_true', dest='restart', default=False,
+                            help='Ignore an existing checkpoint and load from the beginning.')
 
     def handle(self, **options):
         try:
-            user_dict = {}
-            umi_dict = {}
-            msg_dict = {}
-            msgleg_dict = {}
-            data = json.load(open(os.path.join(settings.BASE_DIR, options.get('datafile')), 'r'))
-
-            # we don't want to create tokens automatically on save because we're adding them at end
-            signals.post_save.disconnect(models.User.create_token_trigger, sender=models.User)
-            signals.post_save.disconnect(models.Message.create_token_trigger, sender=models.Message)
-
-            for i in range(0, len(data['User'])):
-                _user = json.loads(data['User'][i])
-                django_user, c = models.DjangoUser.objects.get_or_create(username=_user['email'][0:30], email=_user['email'])
-                user, created = models.User.objects.get_or_create(django_user=django_user)
-                user_dict[_user['id']] = user
-                data['User'][i] = _user
-
-            for i in range(0, len(data['UserMessageInfo'])):
-                _umi = json.loads(data['UserMessageInfo'][i])
-                try:
-                    _umi_id = _umi.pop('id')
-                    _umi['user'] = user_dict[_umi.pop('user_id')]
-                except:
-                    continue
-                _at = timezone.make_aware(datetime.strptime(_umi['created_at'], "%Y-%m-%dT%H:%M:%S.%f"))
-                _umi.update({'created_at': _at, 'updated_at': _at})
-                umi = models.UserMessageInfo(**_umi)
-                if _umi['accept_tos']:
-                    umi.accept_tos = timezone.make_aware(datetime.strptime(_umi['accept_tos'], "%Y-%m-%dT%H:%M:%S.%f"))
-                else:
-                    umi.accept_tos = None
-                if not _umi['district']:
-                    umi.district = None
-                umi.save()
-                umi_dict[_umi_id] = umi
-
-            for i in range(0, len(data['Message'])):
-                _msg = json.loads(data['Message'][i])
-                try:
-                    _msg_id = _msg.pop('id')
-                    _msg['user_message_info'] = umi_dict[_msg.pop('user_message_info_id')]
-                except:
-                    print(_msg)
-                    continue
-                _at = timezone.make_aware(datetime.strptime(_msg['created_at'], "%Y-%m-%dT%H:%M:%S"))
-                _msg.update({'created_at': _at, 'updated_at': _at})
-                msg = models.Message(**_msg)
-                msg.save()
-                msg_dict[_msg_id] = msg
-
-            for i in range(0, len(data['MessageLegislator'])):
-                _msgleg = json.loads(data['MessageLegislator'][i])
-                try:
-                    _msgleg_id = _msgleg.pop('id')
-                    _msgleg['message'] = msg_dict[_msgleg.pop('message_id')]
-                    _msgleg['legislator'] = models.Legislator.objects.filter(bioguide_id=_msgleg.pop('legislator_id')).first()
-                    del _msgleg['topic_id']
-                except:
-                    print(_msgleg)
-                    continue
-                msgleg = models.MessageLegislator(**_msgleg)
-                if not _msgleg['sent']:
-                    msgleg.sent = None
-                msgleg.save()
-                msgleg_dict[_msgleg_id] = msgleg
-
-            for i in range(0, len(data['Token'])):
-                _token = json.loads(data['Token'][i])
-                model = ContentType.objects.get_for_model(model=getattr(models, _token['item_table'].capitalize()))
-                models.Token.objects.get_or_create(key=_token['token'], object_id=_token['item_id'], content_type=model)
-
-            print("Successfully imported JSON data from phantom mask database.")
+            path = os.path.join(settings.BASE_DIR, options.get('datafile'))
+            loader = Loader(options.get('checkpoint') or path + '.checkpoint', batch_size=options['batch_size'])
+            if not options.get('restart'):
+                loader.load_checkpoint()
+            if not loader.checkpoint['offsets']:
+                with open(path, 'r') as f:
+                    loader.reserve_ids(f)
+
+            with utils.preserve_timestamps(models.UserMessageInfo, models.Message), open(path, 'r') as f:
+                loader.run(f)
+            loader.finish()
+
+            print("Successfully imported JSON data from phantom mask database in {0:.1f}s.".format(
+                time.time() - loader.start))
         except:
             print(traceback.format_exc())
+            raise CommandError('Import failed. Rerun the command to resume from the last committed batch.')
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, transaction
+
+CHUNK_SIZE = 10000
+
+
+def backfill_message_user(apps, schema_editor):
+    """
+    Copies each message's user from its user message info in chunks of message ids. Every chunk commits on its
+    own so the backfill doesn't hold locks on the whole message table.
+    """
+    Message = apps.get_model('emailcongress', 'Message')
+    UserMessageInfo = apps.get_model('emailcongress', 'UserMessageInfo')
+    connection = schema_editor.connection
+    qn = connection.ops.quote_name
+
+    sql = 'UPDATE {message} SET {user} = (SELECT {umi_user} FROM {umi} WHERE {umi}.{umi_id} = {message}.{message_umi}) ' \
+          'WHERE {message}.{message_id} >= %s AND {message}.{message_id} < %s AND {message}.{user} IS NULL'.format(
+              message=qn(Message._meta.db_table),
+              user=qn(Message._meta.get_field('user').column),
+              message_umi=qn(Message._meta.get_field('user_message_info').column),
+              message_id=qn(Message._meta.pk.column),
+              umi=qn(UserMessageInfo._meta.db_table),
+              umi_user=qn(UserMessageInfo._meta.get_field('user').column),
+              umi_id=qn(UserMessageInfo._meta.pk.column))
+
+    ids = Message.objects.order_by('id').values_list('id', flat=True)
+    first, last = ids.first(), ids.last()
+    if first is None:
+        return
+    for start in range(first, last + 1, CHUNK_SIZE):
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [start, start + CHUNK_SIZE])
+
+
+class Migration(migrations.Migration):
+
+    # chunks commit separately
+    atomic = False
+
+    dependencies = [
+        ('emailcongress', '0002_message_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_message_user, migrations.RunPython.noop),
+    ]
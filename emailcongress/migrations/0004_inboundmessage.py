@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailcongress', '0003_backfill_message_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboundMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('payload', models.TextField()),
+                ('message_id', models.CharField(blank=True, db_index=True, max_length=1000)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('processed', 'processed'), ('failed', 'failed')], db_index=True, default='pending', max_length=10)),
+                ('result', models.TextField(blank=True, null=True)),
+                ('processed_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
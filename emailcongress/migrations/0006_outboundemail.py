@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailcongress', '0005_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('to', models.CharField(max_length=1000)),
+                ('payload', jsonfield.fields.JSONField()),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('sending', 'sending'), ('sent', 'sent'), ('failed', 'failed')], db_index=True, default='queued', max_length=10)),
+                ('batch', models.CharField(db_index=True, max_length=32, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error_code', models.IntegerField(null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('postmark_message_id', models.CharField(blank=True, max_length=256, null=True)),
+                ('sent_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -1,15 +1,21 @@
+import hashlib
 import random
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
 from datetime import datetime, timedelta
 import uuid
 
 from django.db import models
-from django.db.models import Q
+from django.db.models import Count, Prefetch
+from django.core.cache import cache
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.core import serializers
-from django.db.models.signals import post_save, pre_save, pre_delete, post_delete
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
-from django.contrib.auth.models import User as DjangoUser
+from django.contrib.auth.models import User as DjangoUser, Group
 from django.core.urlresolvers import reverse
 from django.conf import settings
 from django.db import IntegrityError, transaction
@@ -18,11 +24,13 @@ from django.utils import timezone
 from jsonfield import JSONField
 from localflavor.us import models as us_models
 
-from lib.phantom_on_the_capitol import PhantomOfTheCapitol
 from lib import usps
-from services import determine_district_service, geolocation_service, address_inferrence_service
-from emailcongress import utils
-from emailcongress.celery import send_to_phantom_of_the_capitol
+from services import determine_district_service, geolocation_service, address_inferrence_service, phantom_service
+from emailcongress import utils, caching
+from emailcongress.directory import legislator_directory
+from emailcongress.rate_limit import SlidingWindowRateLimiter
+from emailcongress.celery import send_to_phantom_of_the_capitol, send_batch_to_phantom_of_the_capitol, \
+    queue_per_legislator, process_inbound_message
 
 
 class EmailCongressManager(models.Manager):
@@ -55,6 +63,55 @@ class TokenManager(EmailCongressManager):
         """
         return super().prefetch_related('content_object')
 
+    def bulk_mint(self, instances, batch_size=1000, retries=3):
+        """
+        Creates tokens for many objects with one insert per batch rather than a get_or_create per object.
+        Objects that already have a token are skipped. Instances are consumed batch_size at a time, each batch with
+        one query for its existing tokens and one insert, so an iterator over a whole table runs in flat memory.
+        Keys aren't checked for collisions beforehand. Instead, a batch that hits the unique index on key is
+        retried with fresh keys.
+
+        @param instances: saved objects (of any models) to create tokens for
+        @type instances: iterable
+        @param batch_size: number of objects to check and tokens to insert per query
+        @type batch_size: int
+        @param retries: number of times to retry a batch with fresh keys after a key collision
+        @type retries: int
+        @return: number of tokens created
+        @rtype: int
+        """
+        instances = iter(instances)
+        created = 0
+        while True:
+            chunk = list(islice(instances, batch_size))
+            if not chunk:
+                return created
+
+            by_ctype = {}
+            for instance in chunk:
+                ctype = ContentType.objects.get_for_model(instance)
+                by_ctype.setdefault(ctype, set()).add(instance.pk)
+
+            targets = []
+            for ctype, object_ids in by_ctype.items():
+                existing = set(self.filter(content_type=ctype, object_id__in=object_ids)
+                               .values_list('object_id', flat=True))
+                targets += [(ctype, object_id) for object_id in sorted(object_ids - existing)]
+            if not targets:
+                continue
+
+            for attempt in range(retries + 1):
+                tokens = [self.model(content_type=ctype, object_id=object_id, key=self.model.uid_creator())
+                          for ctype, object_id in targets]
+                try:
+                    with transaction.atomic():
+                        self.bulk_create(tokens)
+                    break
+                except IntegrityError:
+                    if attempt == retries:
+                        raise
+            created += len(tokens)
+
 
 class EmailCongressModel(models.Model):
 
@@ -70,6 +127,9 @@ class EmailCongressModel(models.Model):
         return serializers.serialize(to_format, [self,])
 
 
+API_AUTH_NAMESPACE = 'api-auth'
+
+
 class Token(EmailCongressModel):
 
     class Meta:
@@ -102,15 +162,27 @@ class Token(EmailCongressModel):
 
     def save(self, *args, **kwargs):
         """
-        Generates a key if one doesn't exist before saving the token.
+        Generates a key if one doesn't exist before saving the token. Generated keys aren't checked for
+        collisions beforehand so a save that hits the unique index on key is retried with a fresh key.
         """
-        if not self.key:
+        if self.key:
+            return super().save(*args, **kwargs)
+        for attempt in range(3):
             self.key = self.uid_creator()
-        super().save(*args, **kwargs)
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if attempt == 2:
+                    raise
 
     def reset(self, key=None):
-        self.key = key if key is not None else self.uid_creator()
+        Token.uncache_key(self.key)
+        # a None key makes save generate a fresh one
+        self.key = key
         self.save()
+        # a chosen key may have been cached as invalid
+        Token.uncache_key(self.key)
         return self.key
 
     def link(self):
@@ -121,20 +193,88 @@ class Token(EmailCongressModel):
     @classmethod
     def uid_creator(cls):
         """
-        Creates a 64 character string uid, checks for collisions in input class, and returns a uid.
+        Creates a 64 character string uid. Collisions are left to the unique index on key.
 
         @return: 64 character alphanumeric string
         @rtype: str
         """
-        while True:
-            potential_token = uuid.uuid4().hex + uuid.uuid4().hex
-            if cls.objects.filter(key=potential_token).count() == 0:
-                return potential_token
+        return uuid.uuid4().hex + uuid.uuid4().hex
+
+    @staticmethod
+    def _cache_key(key):
+        return 'token:' + key
+
+    @staticmethod
+    def _api_auth_cache_key(key):
+        # keys are credentials so only their hash ends up in the cache
+        return 'api-auth:{0}:{1}'.format(caching.get_namespace_version(API_AUTH_NAMESPACE),
+                                         hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def uncache_key(key):
+        if key:
+            cache.delete_many([Token._cache_key(key), Token._api_auth_cache_key(key)])
+
+    @classmethod
+    def api_credentials(cls, key):
+        """
+        Finds the django user a token key authenticates for the API along with whether the user is active and has
+        API permissions. Answers are cached for misc.api_auth_cache_ttl seconds so that API calls skip the token,
+        user and permission queries. Entries are dropped when the token is reset or deleted, when the django user is
+        saved, and when any user or group permissions change.
+
+        @param key: the string key of the token
+        @type key: str
+        @return: tuple of django user id, is active and has API permission or None if the key doesn't belong to a user
+        @rtype: (int, bool, bool)|None
+        """
+        ttl = settings.CONFIG_DICT['misc'].get('api_auth_cache_ttl', 60)
+        cache_key = cls._api_auth_cache_key(key)
+        credentials = cache.get(cache_key) if ttl else None
+
+        if credentials is None:
+            object_id = cls.objects.filter(key=key, content_type=ContentType.objects.get_for_model(User)) \
+                .values_list('object_id', flat=True).first()
+            django_user = DjangoUser.objects.filter(user__pk=object_id).first() if object_id is not None else None
+            if django_user is None:
+                # unknown keys are cached too so guessing keys doesn't cost queries
+                credentials = ()
+            else:
+                credentials = (django_user.pk, django_user.is_active,
+                               django_user.is_superuser or django_user.has_perm('emailcongress.api'))
+            if ttl:
+                cache.set(cache_key, credentials, timeout=ttl)
+
+        return credentials or None
+
+    @classmethod
+    def resolve_target(cls, key):
+        """
+        Finds the content type and object id a token key points at. When misc.token_cache_ttl is set the
+        answer is cached for that many seconds so repeat visits to a token link skip the token query.
+
+        @param key: the string key of the token
+        @type key: str
+        @return: tuple of content type id and object id or None if the key doesn't exist
+        @rtype: (int, int)|None
+        """
+        ttl = settings.CONFIG_DICT['misc'].get('token_cache_ttl', 0)
+        if ttl:
+            target = cache.get(cls._cache_key(key))
+            if target is not None:
+                return target
+        target = cls.objects.filter(key=key).values_list('content_type_id', 'object_id').first()
+        if target is not None and ttl:
+            cache.set(cls._cache_key(key), target, timeout=ttl)
+        return target
 
     @classmethod
     def convert_token(cls, key):
         """
-        Converts a token to user, the user's default information, and a message.
+        Converts a token to user, the user's default information, and a message. The token's object and
+        everything hanging off of it are loaded with a fixed number of queries (one for the token unless it's
+        cached and one or two for the object) and the token key is remembered on the message and user so that
+        the views don't have to look it up again.
 
         @param key: the string key to convert to other models
         @type key: str
@@ -142,22 +282,32 @@ class Token(EmailCongressModel):
         @rtype: (Message, UserMessageInfo, User)
         """
         msg, umi, user = None, None, None
-        token = cls.objects.filter(key=key).first()
-
-        if token is not None:
-            item = token.content_object
-            if type(item) is User:
-                user = item
-                umi = user.default_info
-            elif type(item) is Message:
-                msg = item
-                umi = msg.user_message_info
-                user = umi.user
+        target = cls.resolve_target(key) if key else None
+
+        if target is not None:
+            model = ContentType.objects.get_for_id(target[0]).model_class()
+            if model is User:
+                user = User.objects.select_related('django_user').prefetch_related(
+                    Prefetch('usermessageinfo_set', queryset=UserMessageInfo.objects.filter(default=True),
+                             to_attr='_default_infos')).filter(pk=target[1]).first()
+                if user is not None:
+                    umi = user.default_info
+                    if umi is not None:
+                        umi.user = user
+                    user._token_key = key
+            elif model is Message:
+                msg = Message.objects.select_related('user_message_info__user__django_user').annotate(
+                    _legislator_count=Count('messagelegislator')).filter(pk=target[1]).first()
+                if msg is not None:
+                    umi = msg.user_message_info
+                    user = umi.user
+                    msg._token_key = key
 
         return msg, umi, user
 
     @staticmethod
     def delete_content_object(sender, instance, **kwargs):
+        Token.uncache_key(instance.key)
         try:
             instance.content_object.delete()
         except:
@@ -166,8 +316,36 @@ class Token(EmailCongressModel):
 receiver(post_delete, sender=Token)(Token.delete_content_object)
 
 
+def uncache_api_credentials(sender, instance, update_fields=None, **kwargs):
+    """
+    Drops the cached API credentials of a django user's tokens when the user changes (e.g. is deactivated).
+    """
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    keys = Token.objects.filter(content_type=ContentType.objects.get_for_model(User),
+                                object_id__in=User.objects.filter(django_user_id=instance.pk).values('pk')) \
+        .values_list('key', flat=True)
+    for key in keys:
+        Token.uncache_key(key)
+
+
+def invalidate_api_credentials(sender, **kwargs):
+    """
+    Permission and group changes can affect any number of users so every cached API credential is dropped.
+    """
+    caching.bump_namespace_version(API_AUTH_NAMESPACE)
+
+receiver(post_save, sender=DjangoUser)(uncache_api_credentials)
+receiver(post_delete, sender=DjangoUser)(uncache_api_credentials)
+receiver(m2m_changed, sender=DjangoUser.user_permissions.through)(invalidate_api_credentials)
+receiver(m2m_changed, sender=DjangoUser.groups.through)(invalidate_api_credentials)
+receiver(m2m_changed, sender=Group.permissions.through)(invalidate_api_credentials)
+
+
 class HasTokenMixin(object):
 
+    _deferred = threading.local()
+
     @property
     def verification_link(self):
         ctype = ContentType.objects.get_for_model(self)
@@ -175,14 +353,42 @@ class HasTokenMixin(object):
 
     @property
     def token_key(self):
-        ctype = ContentType.objects.get_for_model(self)
-        return Token.objects.get(content_type=ctype, object_id=self.pk).key
+        # Token.convert_token remembers the key the object was resolved from
+        if getattr(self, '_token_key', None) is None:
+            ctype = ContentType.objects.get_for_model(self)
+            self._token_key = Token.objects.get(content_type=ctype, object_id=self.pk).key
+        return self._token_key
+
+    @staticmethod
+    @contextmanager
+    def deferred_tokens(batch_size=1000):
+        """
+        Collects the objects created inside the block and mints all their tokens with Token.objects.bulk_mint
+        on exit, instead of creating one token per save. Use it for imports and mass object creation.
+
+        @param batch_size: number of tokens to insert per query
+        @type batch_size: int
+        """
+        if getattr(HasTokenMixin._deferred, 'instances', None) is not None:
+            # nested blocks mint with the outermost one
+            yield
+            return
+        HasTokenMixin._deferred.instances = []
+        try:
+            yield
+            Token.objects.bulk_mint(HasTokenMixin._deferred.instances, batch_size=batch_size)
+        finally:
+            HasTokenMixin._deferred.instances = None
 
     @staticmethod
     def create_token_trigger(sender, instance, created, *args, **kwargs):
         if created:
-            ctype = ContentType.objects.get_for_model(instance)
-            Token.objects.get_or_create(content_type=ctype, object_id=instance.pk)
+            deferred = getattr(HasTokenMixin._deferred, 'instances', None)
+            if deferred is not None:
+                deferred.append(instance)
+            else:
+                ctype = ContentType.objects.get_for_model(instance)
+                Token.objects.create(content_type=ctype, object_id=instance.pk)
 
     @staticmethod
     def delete_related_token(sender, instance, **kwargs):
@@ -294,7 +500,11 @@ class Legislator(EmailCongressModel):
 
     @staticmethod
     def find_by_email(recip_email):
-        return Legislator.objects.filter(email__iexact=Legislator.doctor_email(recip_email)).first()
+        return legislator_directory.find_by_email(recip_email)
+
+    @staticmethod
+    def invalidate_directory(sender, instance, **kwargs):
+        legislator_directory.invalidate()
 
     @staticmethod
     def get_leg_buckets_from_emails(permitted_legs, emails):
@@ -320,7 +530,8 @@ class Legislator(EmailCongressModel):
         # maximize error messages for users for individual addresses
         for recip_email in inbound_emails:
             # IMPORTANT! OC_EMAIL is legacy from @opencongress.org. The new addresses are @emailcongress.us.
-            leg = Legislator.find_by_email(recip_email)
+            # resolved against the in-process directory so this loop doesn't query the database
+            leg = legislator_directory.find_by_email(recip_email)
             if leg is None:
                 legs['non_existent'].append(recip_email)  # TODO refer user to index page?
             elif not leg.contactable:
@@ -336,10 +547,23 @@ class Legislator(EmailCongressModel):
 
     @staticmethod
     def members_for_state_and_district(state, district, contactable=True):
-        query = Q(state=state) & (Q(district=None) | Q(district=district))
-        if contactable:
-            query = query & Q(contactable=True)
-        return Legislator.objects.filter(query).all()
+        """
+        Finds the members of congress of a district, ordered by title, from the delegations precomputed by the
+        legislator directory.
+
+        @param state: two letter state abbreviation
+        @type state: str
+        @param district: congressional district number
+        @type district: int|None
+        @param contactable: whether to leave out legislators that can't be contacted
+        @type contactable: bool
+        @return: list of legislators
+        @rtype: list[Legislator]
+        """
+        return legislator_directory.find_delegation(state, district, contactable=contactable)
+
+receiver(post_save, sender=Legislator)(Legislator.invalidate_directory)
+receiver(post_delete, sender=Legislator)(Legislator.invalidate_directory)
 
 
 class User(EmailCongressModel, HasTokenMixin):
@@ -352,6 +576,9 @@ class User(EmailCongressModel, HasTokenMixin):
 
     @property
     def default_info(self):
+        # Token.convert_token prefetches the default info
+        if hasattr(self, '_default_infos'):
+            return self._default_infos[0] if self._default_infos else None
         return self.usermessageinfo_set.filter(default=True).first()
 
     @property
@@ -367,8 +594,7 @@ class User(EmailCongressModel, HasTokenMixin):
         return self.token.get().link()
 
     def messages(self, **filters):
-        query = Q(**filters) & Q(user_message_info__in=self.usermessageinfo_set.all())
-        return Message.objects.filter(query).order_by('created_at')
+        return Message.objects.filter(user=self, **filters).order_by('created_at')
 
     def last_message(self):
         return self.messages().last()
@@ -385,13 +611,32 @@ class User(EmailCongressModel, HasTokenMixin):
         @return: string to represent whether to allow user to send more messages
         @rtype: str
         """
-        count = self.messages().filter(created_at__gte=(timezone.now() -
-                                       timedelta(hours=settings.CONFIG_DICT['email']['interval_hour_max']))).count()
-        if count > settings.CONFIG_DICT['email']['max_per_interval'] and not force_allow:
+        if self.recent_message_count() > settings.CONFIG_DICT['email']['max_per_interval'] and not force_allow:
             return 'block'
         else:
             return 'free'
 
+    def recent_message_count(self):
+        """
+        @return: number of messages this user has sent within the rate limiting interval
+        @rtype: int|float
+        """
+        if User.rate_limit_backend() == 'cache':
+            return message_rate_limiter.count(self.id, seed=lambda since: [
+                created_at.timestamp() for created_at in self.messages(
+                    created_at__gte=datetime.fromtimestamp(since, timezone.utc)).values_list('created_at', flat=True)])
+        else:
+            return self.messages().filter(created_at__gte=(timezone.now() -
+                                          timedelta(hours=settings.CONFIG_DICT['email']['interval_hour_max']))).count()
+
+    @staticmethod
+    def rate_limit_backend():
+        """
+        @return: 'cache' to count recent messages with message_rate_limiter or 'database' to query them
+        @rtype: str
+        """
+        return settings.CONFIG_DICT['email'].get('rate_limit_backend', 'database')
+
     @staticmethod
     def delete_django_user(sender, instance, **kwargs):
         try:
@@ -420,6 +665,10 @@ receiver(pre_delete, sender=User)(User.delete_related_token)
 receiver(post_save, sender=User)(User.create_token_trigger)
 
 
+message_rate_limiter = SlidingWindowRateLimiter('messages',
+                                                 window=settings.CONFIG_DICT['email']['interval_hour_max'] * 60 * 60)
+
+
 class UserMessageInfo(EmailCongressModel):
 
     user = models.ForeignKey(User, db_index=True)
@@ -456,7 +705,7 @@ class UserMessageInfo(EmailCongressModel):
     def members_of_congress(self):
         if self.district is None:
             self.determine_district()
-        return Legislator.members_for_state_and_district(self.state, self.district).order_by('title')
+        return Legislator.members_for_state_and_district(self.state, self.district)
 
     @property
     def humanized_district(self):
@@ -540,6 +789,10 @@ class UserMessageInfo(EmailCongressModel):
 
 class Message(EmailCongressModel, HasTokenMixin):
 
+    class Meta:
+        # per user message queries (history, rate limiting) filter on user and a created_at range
+        index_together = [('user', 'created_at')]
+
     token = GenericRelation(Token, db_index=True)
 
     to_originally = JSONField(max_length=8000)
@@ -548,16 +801,26 @@ class Message(EmailCongressModel, HasTokenMixin):
     email_uid = models.CharField(max_length=1000)
     status = models.CharField(max_length=10, null=True, default='free')
     user_message_info = models.ForeignKey(UserMessageInfo)
+    # denormalized from user_message_info so a user's messages can be found without joining through their infos
+    user = models.ForeignKey(User, null=True, db_index=False)
 
     def __str__(self):
         return "[{0}] {1}".format(self.id, self.subject[:25])
 
+    def save(self, *args, **kwargs):
+        if self.user_id is None and self.user_message_info_id is not None:
+            self.user_id = self.user_message_info.user_id
+        super().save(*args, **kwargs)
+
     @property
     def to_legislators(self):
         return self.messagelegislator_set.all()
 
     @property
     def has_legislators(self):
+        # Token.convert_token annotates the count
+        if getattr(self, '_legislator_count', None) is not None:
+            return self._legislator_count > 0
         return self.messagelegislator_set.count() > 0
 
     @property
@@ -566,9 +829,9 @@ class Message(EmailCongressModel, HasTokenMixin):
 
     def get_legislators(self, as_dict=False):
         if as_dict:
-            return {leg.legislator.bioguide_id: leg for leg in self.messagelegislator_set.all()}
+            return {leg.legislator.bioguide_id: leg for leg in self.messagelegislator_set.select_related('legislator')}
         else:
-            return [ml.legislator for ml in self.messagelegislator_set.all()]
+            return [ml.legislator for ml in self.messagelegislator_set.select_related('legislator')]
 
     def generate_message_legislators(self, legislators):
         if type(legislators) is not list:
@@ -576,10 +839,12 @@ class Message(EmailCongressModel, HasTokenMixin):
         return [MessageLegislator.objects.get_or_create(message_id=self.id, legislator=leg)[0] for leg in legislators]
 
     def set_legislators(self, legislators):
+        self._legislator_count = None
         MessageLegislator.objects.filter(message_id=self.id).delete()
         self.messagelegislator_set.set(self.generate_message_legislators(legislators))
 
     def add_legislators(self, legislators):
+        self._legislator_count = None
         self.messagelegislator_set.add(self.generate_message_legislators(legislators))
 
     def is_free_to_send(self):
@@ -589,6 +854,11 @@ class Message(EmailCongressModel, HasTokenMixin):
         self.status = self.user_message_info.user.get_rate_limit_status()
         self.save()
 
+    @staticmethod
+    def count_toward_rate_limit(sender, instance, created, *args, **kwargs):
+        if created and User.rate_limit_backend() == 'cache':
+            message_rate_limiter.hit(instance.user_id)
+
     def free_status(self):
         self.status = 'free'
         self.save()
@@ -610,17 +880,135 @@ class Message(EmailCongressModel, HasTokenMixin):
     def queue_to_send(self, moc=None):
         if moc is not None:
             self.set_legislators(moc)
-        send_to_phantom_of_the_capitol.delay(msg_id=self.id)
+        if phantom_service.phantom_config()['per_legislator_tasks']:
+            queue_per_legislator(self.id, list(self.messagelegislator_set.values_list('id', flat=True)))
+        else:
+            send_to_phantom_of_the_capitol.delay(msg_id=self.id)
+
+    def send(self, fresh=False, phantom=None, form_elements=None):
+        """
+        Sends this message to all of its legislators concurrently. The required actions for every legislator's
+        form are retrieved from phantom of the capitol in a single call unless they're provided.
+
+        @param fresh: whether to return only the newly sent message legislators
+        @type fresh: bool
+        @param phantom: client to reuse
+        @type phantom: lib.phantom_on_the_capitol.PhantomOfTheCapitol
+        @param form_elements: previously retrieved required actions keyed by bioguide_id
+        @type form_elements: dict
+        @return: the message legislators
+        @rtype: list[MessageLegislator]|django.db.models.query.QuerySet
+        """
+        msg_legs = [ml for ml in self.messagelegislator_set.select_related('legislator') if not ml.is_sent()]
+        for msg_leg in msg_legs:
+            msg_leg.message = self
+
+        if phantom is None:
+            phantom = phantom_service.phantom_client()
+        if form_elements is None:
+            form_elements = MessageLegislator.retrieve_form_elements(msg_legs, phantom)
+
+        # build submissions up front so only the HTTP calls happen on the thread pool
+        submissions = []
+        for msg_leg in msg_legs:
+            try:
+                submissions.append((msg_leg, msg_leg.build_submission(form_elements)))
+            except:
+                continue
+
+        to_submit = [(ml, json_dict) for ml, json_dict in submissions if json_dict is not None]
+        results = phantom_service.fill_out_forms(phantom, [(phantom_service.contact_form_host(ml.legislator.contact_form),
+                                                            json_dict) for ml, json_dict in to_submit])
+        results = {ml.id: result for (ml, json_dict), result in zip(to_submit, results)}
 
-    def send(self, fresh=False):
         newly_sent = []
-        for msg_leg in self.messagelegislator_set.all():
+        for msg_leg, json_dict in submissions:
             try:
-                newly_sent.append(msg_leg.send())
+                newly_sent.append(msg_leg.record_result(results.get(msg_leg.id), submitted=json_dict is not None))
             except:
                 continue
         return newly_sent if fresh else self.messagelegislator_set.all()
 
+    @staticmethod
+    def send_batch(messages):
+        """
+        Sends a batch of messages with a single retrieval of required actions for all of their legislators.
+
+        @param messages: messages to send
+        @type messages: list[Message]
+        @return: the messages
+        @rtype: list[Message]
+        """
+        messages = list(messages)
+        phantom = phantom_service.phantom_client()
+        msg_legs = MessageLegislator.objects.filter(message__in=messages).select_related('legislator')
+        form_elements = MessageLegislator.retrieve_form_elements(msg_legs, phantom)
+        for msg in messages:
+            msg.send(phantom=phantom, form_elements=form_elements)
+        return messages
+
+    @staticmethod
+    def create_batch(messages, legislators, batch_size=1000):
+        """
+        Saves messages along with their message legislators and tokens using bulk inserts rather than a few
+        queries per message. Primary keys are reserved up front so the message legislators and tokens can refer
+        to the messages. Without a sequence to reserve from the messages are saved one by one.
+
+        @param messages: unsaved messages
+        @type messages: list[Message]
+        @param legislators: legislators of each message in the same order as the messages
+        @type legislators: list[list[Legislator]]
+        @param batch_size: number of rows per insert
+        @type batch_size: int
+        @return: the saved messages
+        @rtype: list[Message]
+        """
+        ids = utils.reserve_ids(Message, len(messages)) if messages else []
+        with transaction.atomic():
+            if ids is None:
+                for msg in messages:
+                    msg.save()
+            else:
+                for msg, pk in zip(messages, ids):
+                    msg.id = pk
+                    if msg.user_id is None:
+                        msg.user_id = msg.user_message_info.user_id
+                Message.objects.bulk_create(messages, batch_size=batch_size)
+                # bulk_create skips the post_save receivers
+                Token.objects.bulk_mint(messages, batch_size=batch_size)
+                if User.rate_limit_backend() == 'cache':
+                    for user_id, count in Counter(msg.user_id for msg in messages).items():
+                        message_rate_limiter.hit(user_id, amount=count)
+            MessageLegislator.objects.bulk_create([MessageLegislator(message_id=msg.id, legislator=leg)
+                                                   for msg, legs in zip(messages, legislators) for leg in legs],
+                                                  batch_size=batch_size)
+        for msg, legs in zip(messages, legislators):
+            msg._legislator_count = len(legs)
+        return messages
+
+    @staticmethod
+    def queue_batch_to_send(messages):
+        """
+        Enqueues many messages with one send_batch_to_phantom_of_the_capitol task per phantom.batch_size messages,
+        or one task per legislator when phantom.per_legislator_tasks is set.
+
+        @param messages: saved messages
+        @type messages: list[Message]
+        """
+        config = phantom_service.phantom_config()
+        messages = list(messages)
+        if config['per_legislator_tasks']:
+            msgleg_ids = {}
+            for msg_id, msgleg_id in MessageLegislator.objects.filter(message__in=messages) \
+                    .values_list('message_id', 'id'):
+                msgleg_ids.setdefault(msg_id, []).append(msgleg_id)
+            for msg in messages:
+                queue_per_legislator(msg.id, msgleg_ids.get(msg.id, []))
+        else:
+            batch_size = int(config['batch_size'])
+            for i in range(0, len(messages), batch_size):
+                send_batch_to_phantom_of_the_capitol.delay(msg_ids=[msg.id for msg in messages[i:i + batch_size]])
+
     def map_to_contact_congress_fields(self):
         umi = self.user_message_info
         return {
@@ -644,6 +1032,7 @@ class Message(EmailCongressModel, HasTokenMixin):
 
 receiver(pre_delete, sender=Message)(Message.delete_related_token)
 receiver(post_save, sender=Message)(Message.create_token_trigger)
+receiver(post_save, sender=Message)(Message.count_toward_rate_limit)
 
 
 class MessageLegislator(EmailCongressModel):
@@ -659,41 +1048,97 @@ class MessageLegislator(EmailCongressModel):
     def is_sent(self):
         return self.sent not in [None, False]
 
-    def send(self):
+    @staticmethod
+    def retrieve_form_elements(msg_legs, phantom):
+        """
+        Retrieves the required actions for the legislators of all unsent message legislators in one call.
+
+        @param msg_legs: message legislators
+        @type msg_legs: iterable
+        @param phantom: phantom of the capitol client
+        @type phantom: lib.phantom_on_the_capitol.PhantomOfTheCapitol
+        @return: required actions keyed by bioguide_id
+        @rtype: dict
+        """
+        bioguide_ids = sorted({ml.legislator.bioguide_id for ml in msg_legs if not ml.is_sent() and ml.legislator})
+        if not bioguide_ids:
+            return {}
+        return phantom_service.retrieve_form_elements(phantom, bioguide_ids) or {}
+
+    def build_submission(self, form_elements):
+        """
+        Builds the data to submit to phantom of the capitol from the required actions of the legislator's form.
+
+        @param form_elements: required actions keyed by bioguide_id
+        @type form_elements: dict
+        @return: json dict for PhantomOfTheCapitol.fill_out_form or None if there are no required actions
+        @rtype: dict|None
+        """
+        bioguide_id = self.legislator.bioguide_id
+        ra = form_elements.get(bioguide_id)
+        if ra is None:
+            return None
+
+        json_dict = self.map_to_contact_congress()
+
+        for step in ra['required_actions']:
+            field = step.get('value')
+            options = step.get('options_hash')
+            if options is not None:
+                # convert first to dictionary for convenience
+                if type(options) is not dict:
+                    options = {k: k for k in options}
+                if field == '$TOPIC':
+                    # TODO handle more sophisticated topic selection
+                    # need lower case strings for select-solver
+                    options = {k.lower(): v for k, v in options.items()}
+
+                if field not in json_dict['fields'] or json_dict['fields'][field] not in options.values():
+                    json_dict['fields'][field] = random.choice(list(options.values()))
+            if field not in json_dict['fields'].keys():
+                print('What the heck is ' + step.get('value') + ' in ' + bioguide_id + '?')
+        return json_dict
+
+    def record_result(self, result, submitted=True):
+        """
+        Records the result of a submission to phantom of the capitol.
+
+        @param result: result of PhantomOfTheCapitol.fill_out_form
+        @type result: dict|None
+        @param submitted: whether a form was submitted at all
+        @type submitted: bool
+        @return: instance of this message to the legislator
+        @rtype: MessageLegislator
+        """
+        if submitted:
+            if result is None:
+                result = {'status': 'error', 'message': 'No response from phantom of the capitol.'}
+            self.sent = result['status'] == 'success'
+            self.send_status = result
+        self.save()
+        return self
+
+    def send(self, phantom=None, form_elements=None):
         """
         Method that actually passes information to phantom of the capitol to send.
 
+        @param phantom: client to reuse
+        @type phantom: lib.phantom_on_the_capitol.PhantomOfTheCapitol
+        @param form_elements: previously retrieved required actions keyed by bioguide_id
+        @type form_elements: dict
         @return: instance of this message to the legislator
         @rtype: MessageLegislator
         """
         if not self.is_sent():
 
-            phantom = PhantomOfTheCapitol(endpoint=settings.CONFIG_DICT['api_endpoints']['phantom_base'])
-
-            for bioguide_id, ra in phantom.retrieve_form_elements([self.legislator.bioguide_id]).items():
-                json_dict = self.map_to_contact_congress()
-
-                for step in ra['required_actions']:
-                    field = step.get('value')
-                    options = step.get('options_hash')
-                    if options is not None:
-                        # convert first to dictionary for convenience
-                        if type(options) is not dict:
-                            options = {k: k for k in options}
-                        if field == '$TOPIC':
-                            # TODO handle more sophisticated topic selection
-                            # need lower case strings for select-solver
-                            options = {k.lower(): v for k, v in options.items()}
-
-                        if field not in json_dict['fields'] or json_dict['fields'][field] not in options.values():
-                            json_dict['fields'][field] = random.choice(list(options.values()))
-                    if field not in json_dict['fields'].keys():
-                        print('What the heck is ' + step.get('value') + ' in ' + bioguide_id + '?')
-                result = phantom.fill_out_form(json_dict)
-                self.sent = result['status'] == 'success'
-                self.send_status = result
-            self.save()
-            return self
+            if phantom is None:
+                phantom = phantom_service.phantom_client()
+            if form_elements is None:
+                form_elements = phantom_service.retrieve_form_elements(phantom, [self.legislator.bioguide_id])
+
+            json_dict = self.build_submission(form_elements)
+            result = phantom.fill_out_form(json_dict) if json_dict is not None else None
+            return self.record_result(result, submitted=json_dict is not None)
 
     def map_to_contact_congress(self, campaign_tag=False):
         data = {
@@ -704,3 +1149,71 @@ class MessageLegislator(EmailCongressModel):
             data['campaign_tag'] = self.message.email_uid
 
         return data
+
+
+class InboundMessage(EmailCongressModel):
+    """
+    Raw JSON of an inbound email from the Postmark webhook, persisted so the webhook can return immediately and
+    the email is processed by a celery task.
+    """
+
+    STATUS_CHOICES = (
+        ('pending', 'pending'),
+        ('processed', 'processed'),
+        ('failed', 'failed')
+    )
+
+    payload = models.TextField()
+    message_id = models.CharField(max_length=1000, blank=True, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', db_index=True)
+    result = models.TextField(blank=True, null=True)
+    processed_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return "[{0}] {1}".format(self.id, self.message_id)
+
+    def queue_to_process(self):
+        process_inbound_message.delay(inbound_id=self.id)
+
+    def mark(self, status, result=None):
+        self.status = status
+        self.result = result
+        self.processed_at = timezone.now()
+        self.save(update_fields=['status', 'result', 'processed_at', 'updated_at'])
+
+
+class IdempotencyKey(EmailCongressModel):
+    """
+    Hash of an id that has been handled, see emailcongress.idempotency.
+    """
+
+    key_hash = models.CharField(max_length=40, unique=True)
+
+    def __str__(self):
+        return self.key_hash
+
+
+class OutboundEmail(EmailCongressModel):
+    """
+    Rendered email waiting to be sent with the next Postmark batch, see services.outbound_mail_service.
+    """
+
+    STATUS_CHOICES = (
+        ('queued', 'queued'),
+        ('sending', 'sending'),
+        ('sent', 'sent'),
+        ('failed', 'failed')
+    )
+
+    to = models.CharField(max_length=1000)
+    payload = JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued', db_index=True)
+    batch = models.CharField(max_length=32, null=True, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error_code = models.IntegerField(null=True)
+    error = models.TextField(blank=True, null=True)
+    postmark_message_id = models.CharField(max_length=256, blank=True, null=True)
+    sent_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return "[{0}] {1}: {2}".format(self.id, self.to, self.payload.get('Subject', ''))
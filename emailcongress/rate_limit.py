@@ -0,0 +1,120 @@
+import time
+
+from django.core.cache import caches
+
+
+class SlidingWindowRateLimiter(object):
+    """
+    Counts events per identifier (e.g. messages per user) over a sliding window using atomic counters in the cache.
+
+    The window is split into buckets and each event increments the counter of the bucket it falls in. The count
+    is the sum of the buckets inside the window plus the overlapping fraction of the oldest bucket. That way the
+    cost of a check doesn't depend on how many events an identifier has ever had.
+    """
+
+    def __init__(self, prefix, window, buckets=12, cache_alias='default'):
+        """
+        @param prefix: prefix of the cache keys so several limiters can share a cache
+        @type prefix: str
+        @param window: length of the window in seconds
+        @type window: int|float
+        @param buckets: number of buckets the window is split into
+        @type buckets: int
+        @param cache_alias: name of the django cache to keep the counters in
+        @type cache_alias: str
+        """
+        self.prefix = prefix
+        self.window = window
+        self.buckets = buckets
+        self.bucket_width = float(window) / buckets
+        self.cache_alias = cache_alias
+        # counters outlive the window by a bucket so the partially overlapping oldest bucket can be read
+        self.timeout = int(window + self.bucket_width) + 1
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _bucket(self, timestamp):
+        return int(timestamp // self.bucket_width)
+
+    def _key(self, ident, bucket):
+        return 'ratelimit:{0}:{1}:{2}'.format(self.prefix, ident, bucket)
+
+    def _seeded_key(self, ident):
+        return 'ratelimit:{0}:{1}:seeded'.format(self.prefix, ident)
+
+    def hit(self, ident, amount=1, now=None):
+        """
+        Records events for an identifier.
+
+        @param ident: identifier to count events for
+        @type ident: str|int
+        @param amount: number of events
+        @type amount: int
+        @param now: unix time of the events, defaults to now
+        @type now: float
+        """
+        key = self._key(ident, self._bucket(now if now is not None else time.time()))
+        try:
+            self.cache.incr(key, amount)
+        except ValueError:
+            # first event in this bucket, unless another process created the counter in the meantime
+            if not self.cache.add(key, amount, timeout=self.timeout):
+                self.cache.incr(key, amount)
+
+    def seed(self, ident, timestamps, now=None):
+        """
+        Overwrites the counters of an identifier from the source of truth, e.g. after the cache was flushed.
+
+        @param ident: identifier to seed the counters of
+        @type ident: str|int
+        @param timestamps: unix times of the identifier's events within the window
+        @type timestamps: iterable
+        """
+        now = now if now is not None else time.time()
+        counts = {self._key(ident, bucket): 0 for bucket in self._window_buckets(now)}
+        for timestamp in timestamps:
+            key = self._key(ident, self._bucket(timestamp))
+            if key in counts:
+                counts[key] += 1
+        self.cache.set_many(counts, timeout=self.timeout)
+
+    def _window_buckets(self, now):
+        current = self._bucket(now)
+        return range(current - self.buckets, current + 1)
+
+    def count(self, ident, now=None, seed=None):
+        """
+        Counts the events of an identifier within the sliding window.
+
+        @param ident: identifier to count events for
+        @type ident: str|int
+        @param now: unix time the window ends at, defaults to now
+        @type now: float
+        @param seed: called with the unix time the oldest bucket starts at to get the timestamps of the
+                     identifier's events from the source of truth when its counters haven't been seeded for a window
+        @type seed: callable
+        @return: approximate number of events in the window
+        @rtype: float
+        """
+        now = now if now is not None else time.time()
+        if seed is not None and self.cache.add(self._seeded_key(ident), True, timeout=self.timeout):
+            # counters may be missing if the cache was flushed or the identifier is new to this limiter
+            self.seed(ident, seed(self._window_buckets(now)[0] * self.bucket_width), now=now)
+
+        buckets = list(self._window_buckets(now))
+        values = self.cache.get_many([self._key(ident, bucket) for bucket in buckets])
+        oldest = buckets[0]
+        # fraction of the oldest bucket that is still inside the window
+        overlap = 1 - ((now - self.window) - oldest * self.bucket_width) / self.bucket_width
+        total = 0.0
+        for bucket in buckets:
+            value = values.get(self._key(ident, bucket), 0)
+            total += value * max(min(overlap, 1), 0) if bucket == oldest else value
+        return total
+
+    def reset(self, ident, now=None):
+        now = now if now is not None else time.time()
+        self.cache.delete_many([self._key(ident, bucket) for bucket in self._window_buckets(now)] +
+                               [self._seeded_key(ident)])
@@ -5,3 +5,10 @@ SECRET_KEY = 'fake-key'
 INSTALLED_APPS += [
     "tests",
 ]
+
+# keeps caches (including the rate limiter's counters) in process so tests don't need memcached
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
@@ -1,5 +1,7 @@
 from django import template
 
+from emailcongress import fragments
+
 register = template.Library()
 
 
@@ -41,7 +43,27 @@ def humanize_legislator_list(legislators):
     @return: humanized string representation of list
     @rtype: string
     """
-    return humanize_list([leg.full_title_and_full_name for leg in legislators])
+    return fragments.humanized_names(legislators)
+
+
+@register.simple_tag
+def legislator_fragment(template_name, legislators):
+    """
+    {% legislator_fragment <template_name> <legislator or legislators> %}
+
+    Renders a template that only depends on legislators from the fragment cache.
+    """
+    return fragments.legislators(template_name, legislators)
+
+
+@register.simple_tag
+def delegation_fragment(template_name, umi):
+    """
+    {% delegation_fragment <template_name> <user message info> %}
+
+    Renders a template listing the members of congress of a user's district from the fragment cache.
+    """
+    return fragments.delegation(template_name, umi)
 
 
 @register.filter
@@ -1,5 +1,6 @@
+from contextlib import contextmanager
 from urllib import parse
-from django.db.models import signals
+from django.db import connection
 
 
 def bool_eval(v):
@@ -24,3 +25,40 @@ def construct_link(protocol, hostname, path, get_param_dict=None):
     if get_param_dict is not None:
         link += '?' + parse.urlencode(get_param_dict)
     return link
+
+
+@contextmanager
+def preserve_timestamps(*model_classes):
+    """
+    Disables auto_now and auto_now_add so bulk inserts keep the created_at and updated_at they were given.
+    """
+    fields = [field for model_class in model_classes for field in model_class._meta.fields
+              if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    flags = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in flags:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def reserve_ids(model_class, count):
+    """
+    Reserves primary keys from a model's id sequence so that rows inserted with bulk_create, which doesn't return
+    primary keys on this version of Django, can be referenced right away.
+
+    @param model_class: model whose ids to reserve
+    @type model_class: django.db.models.Model
+    @param count: number of ids to reserve
+    @type count: int
+    @return: the reserved ids or None if the database has no sequences to reserve from
+    @rtype: list[int]|None
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+                       [model_class._meta.db_table, model_class._meta.pk.column, count])
+        return [row[0] for row in cursor.fetchall()]
@@ -9,6 +9,7 @@ from django.shortcuts import redirect
 from django.utils import timezone
 from django.contrib import messages
 from django.core.urlresolvers import reverse
+from django.conf import settings
 
 # external
 from postmark_inbound import PostmarkInbound
@@ -16,8 +17,9 @@ from raven.contrib.django.raven_compat.models import client
 
 # internal
 from emailcongress.forms import UserMessageInfoForm, EmailForm, MessageForm
-from emailcongress.models import User, Message, Legislator, Token
+from emailcongress.models import User, Message, Legislator, Token, InboundMessage
 from emailcongress import emailer
+from emailcongress.idempotency import postmark_ingest_ledger, postmark_inbound_ledger
 from api.views import MessageViewSet
 from services import address_inferrence_service
 
@@ -231,37 +233,79 @@ class PostmarkView(View):
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
 
-    @csrf_exempt
-    def post(self, request, *args, **kwargs):
-        try:
-            inbound = PostmarkInbound(json=request.body.decode('utf-8'))
-            django_user, user, umi = User.get_or_create_user_from_email(inbound.sender()['Email'].lower())
-
-            # get message id for email threading
-            if 'Headers' in inbound.source and inbound.headers('Message-ID') is not None:
-                msg_id = inbound.headers('Message-ID')
-            else:
-                msg_id = inbound.message_id()
-
-            if not Message.objects.filter(email_uid=inbound.message_id()).exists():
+    @staticmethod
+    def process_inbound(payload):
+        """
+        Creates the user and message for an inbound email and queues the message to send.
+
+        @param payload: JSON body of the Postmark inbound webhook
+        @type payload: str
+        @return: dictionary with the status of the email
+        @rtype: dict
+        """
+        inbound = PostmarkInbound(json=payload)
+        django_user, user, umi = User.get_or_create_user_from_email(inbound.sender()['Email'].lower())
+
+        # get message id for email threading
+        if 'Headers' in inbound.source and inbound.headers('Message-ID') is not None:
+            msg_id = inbound.headers('Message-ID')
+        else:
+            msg_id = inbound.message_id()
 
+        if postmark_inbound_ledger.claim(inbound.message_id()):
+            try:
                 new_msg = Message.objects.create(created_at=inbound.send_date(),
                                                  to_originally=[r['Email'].lower() for r in inbound.to()],
                                                  subject=inbound.subject(),
                                                  msgbody=inbound.text_body(),
                                                  email_uid=msg_id,
                                                  user_message_info=umi)
-
-                # first time user or it has been a long time since they've updated their address info
-                if umi.must_update_address_info():
-                    emailer.NoReply(django_user).email_confirm(new_msg).send()
-                    return JsonResponse({'status': 'User must accept tos / update their address info.'})
-                else:
-                    MessageViewSet.process_inbound_message(django_user, umi, new_msg)
-                    return JsonResponse({'status': 'Message queued for processing.'})
+            except:
+                # let a redelivery try again
+                postmark_inbound_ledger.release(inbound.message_id())
+                raise
+
+            # first time user or it has been a long time since they've updated their address info
+            if umi.must_update_address_info():
+                emailer.NoReply(django_user).email_confirm(new_msg).send()
+                return {'status': 'User must accept tos / update their address info.'}
             else:
-                return JsonResponse({'status': 'Message with provided ID already received.'})
-                # TODO robust error handling
+                MessageViewSet.process_inbound_message(django_user, umi, new_msg)
+                return {'status': 'Message queued for processing.'}
+        else:
+            return {'status': 'Message with provided ID already received.'}
+            # TODO robust error handling
+
+    @staticmethod
+    def ingest_inbound(payload):
+        """
+        Persists an inbound email and queues it to be processed by a celery task so the webhook returns without
+        waiting on geocoding, phantom of the capitol or outbound email.
+
+        @param payload: JSON body of the Postmark inbound webhook
+        @type payload: str
+        @return: dictionary with the status of the email
+        @rtype: dict
+        """
+        message_id = json.loads(payload).get('MessageID', '')
+        # redeliveries of an email we already have are no-ops
+        if message_id and not postmark_ingest_ledger.claim(message_id):
+            return {'status': 'Message with provided ID already received.'}
+        try:
+            inbound = InboundMessage.objects.create(payload=payload, message_id=message_id)
+        except:
+            postmark_ingest_ledger.release(message_id)
+            raise
+        inbound.queue_to_process()
+        return {'status': 'Message received.'}
+
+    @csrf_exempt
+    def post(self, request, *args, **kwargs):
+        try:
+            payload = request.body.decode('utf-8')
+            if settings.CONFIG_DICT['email'].get('async_inbound', False):
+                return JsonResponse(PostmarkView.ingest_inbound(payload))
+            return JsonResponse(PostmarkView.process_inbound(payload))
         except:
             client.captureException()
             return 'Failure', 500
@@ -0,0 +1,145 @@
+import json
+import math
+import os
+import re
+
+
+class DistrictBoundaries():
+    """
+    In-process point-in-polygon engine that answers (latitude, longitude) -> (state, district) from
+    congressional district boundary files.
+
+    Polygons are registered in a uniform grid of cell_size degree cells by their bounding boxes. A lookup only
+    tests the polygons registered in the point's cell whose bounding box contains the point.
+    """
+
+    # unitedstates/districts style names (e.g. cds/2012/VA-8/shape.geojson) or the
+    # FIPS + district names used by Legislator.get_district_geojson_url (e.g. 5108.geojson)
+    STATE_DISTRICT_NAME = re.compile(r'^([A-Z]{2})-(\d+)$')
+    FIPS_DISTRICT_NAME = re.compile(r'^(\d{2})(\d{2})$')
+
+    def __init__(self, cell_size=0.5):
+        """
+        @param cell_size: width and height of a grid cell in degrees
+        @type cell_size: float
+        """
+        self.cell_size = cell_size
+        self.polygons = []
+        self.grid = {}
+
+    def __len__(self):
+        return len({(p[0], p[1]) for p in self.polygons})
+
+    @classmethod
+    def from_directory(cls, path, fips_to_state, cell_size=0.5):
+        """
+        Loads every .geojson file found under a directory. The district of each file is taken from
+        its file name or, failing that, the name of its parent directory.
+
+        @param path: directory of boundary files
+        @type path: str
+        @param fips_to_state: mapping of two digit FIPS codes to postal state abbreviations
+        @type fips_to_state: dict[str, str]
+        @param cell_size: width and height of a grid cell in degrees
+        @type cell_size: float
+        @return: the loaded engine
+        @rtype: DistrictBoundaries
+        """
+        engine = cls(cell_size=cell_size)
+        for root, dirs, files in os.walk(path):
+            for filename in sorted(files):
+                if not filename.endswith('.geojson'):
+                    continue
+                stem = os.path.splitext(filename)[0]
+                district = (cls.parse_district_name(stem, fips_to_state) or
+                            cls.parse_district_name(os.path.basename(root), fips_to_state))
+                if district is None:
+                    continue
+                with open(os.path.join(root, filename), mode='r') as f:
+                    engine.add_geojson(district[0], district[1], json.load(f))
+        return engine
+
+    @classmethod
+    def parse_district_name(cls, name, fips_to_state):
+        match = cls.STATE_DISTRICT_NAME.match(name)
+        if match:
+            return match.group(1), int(match.group(2))
+        match = cls.FIPS_DISTRICT_NAME.match(name)
+        if match and match.group(1) in fips_to_state:
+            return fips_to_state[match.group(1)], int(match.group(2))
+        return None
+
+    def add_geojson(self, state, district, geojson):
+        """
+        Adds the polygons of a GeoJSON geometry, feature or feature collection for a district.
+        """
+        geo_type = geojson.get('type')
+        if geo_type == 'FeatureCollection':
+            for feature in geojson.get('features', []):
+                self.add_geojson(state, district, feature)
+        elif geo_type == 'Feature':
+            self.add_geojson(state, district, geojson.get('geometry') or {})
+        elif geo_type == 'Polygon':
+            self.add_polygon(state, district, geojson['coordinates'])
+        elif geo_type == 'MultiPolygon':
+            for polygon in geojson['coordinates']:
+                self.add_polygon(state, district, polygon)
+
+    def add_polygon(self, state, district, rings):
+        """
+        Adds a single polygon given as GeoJSON rings (outer ring first, then holes) of [lng, lat] positions.
+        """
+        rings = [[(float(pt[0]), float(pt[1])) for pt in ring] for ring in rings if ring]
+        if not rings:
+            return
+        lngs = [pt[0] for pt in rings[0]]
+        lats = [pt[1] for pt in rings[0]]
+        bbox = (min(lngs), min(lats), max(lngs), max(lats))
+
+        idx = len(self.polygons)
+        self.polygons.append((state, district, bbox, rings))
+        for cell in self._cells(bbox):
+            self.grid.setdefault(cell, []).append(idx)
+
+    def _cell(self, lng, lat):
+        return int(math.floor(lng / self.cell_size)), int(math.floor(lat / self.cell_size))
+
+    def _cells(self, bbox):
+        x0, y0 = self._cell(bbox[0], bbox[1])
+        x1, y1 = self._cell(bbox[2], bbox[3])
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                yield x, y
+
+    @staticmethod
+    def _in_ring(lng, lat, ring):
+        inside = False
+        j = len(ring) - 1
+        for i in range(len(ring)):
+            xi, yi = ring[i]
+            xj, yj = ring[j]
+            if (yi > lat) != (yj > lat) and lng < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+                inside = not inside
+            j = i
+        return inside
+
+    def lookup(self, latitude, longitude):
+        """
+        Finds the district containing a point in the same form as the Sunlight congress API
+        locate_districts_by_lat_lon.
+
+        @param latitude: latitude of the point
+        @type latitude: float|str
+        @param longitude: longitude of the point
+        @type longitude: float|str
+        @return: list with a dictionary of state and district, or None if no district contains the point
+        @rtype: list[dict]|None
+        """
+        lat, lng = float(latitude), float(longitude)
+        for idx in self.grid.get(self._cell(lng, lat), ()):
+            state, district, bbox, rings = self.polygons[idx]
+            if not (bbox[0] <= lng <= bbox[2] and bbox[1] <= lat <= bbox[3]):
+                continue
+            if self._in_ring(lng, lat, rings[0]) and not any(self._in_ring(lng, lat, hole) for hole in rings[1:]):
+                return [{'state': state, 'district': district}]
+        return None
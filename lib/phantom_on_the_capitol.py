@@ -7,6 +7,8 @@ class PhantomOfTheCapitol():
     def __init__(self, endpoint, opts=None):
         self.endpoint = endpoint
         self.opts = opts
+        # seconds to wait on phantom of the capitol before giving up on a request
+        self.timeout = (opts or {}).get('timeout')
 
     def retrieve_form_elements(self, args):
         """
@@ -19,7 +21,8 @@ class PhantomOfTheCapitol():
         try:
             steps = requests.post(self.endpoint + '/retrieve-form-elements',
                                   headers={"Content-Type": 'application/json'},
-                                  data=json.dumps({'bio_ids': bioguide_ids}))
+                                  data=json.dumps({'bio_ids': bioguide_ids}),
+                                  timeout=self.timeout)
 
             return steps.json()
         except:
@@ -50,7 +53,8 @@ class PhantomOfTheCapitol():
         try:
             r = requests.post(self.endpoint + '/fill-out-form',
                               headers={"Content-Type": 'application/json'},
-                              data=json.dumps(json_dict))
+                              data=json.dumps(json_dict),
+                              timeout=self.timeout)
 
             return r.json()
         except:
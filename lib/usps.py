@@ -1,3 +1,8 @@
+import codecs
+import re
+import threading
+from html.parser import HTMLParser
+
 import requests
 from bs4 import BeautifulSoup
 from localflavor.us.us_states import USPS_CHOICES
@@ -5,12 +10,101 @@ from localflavor.us.us_states import USPS_CHOICES
 CODE_TO_STATE = dict(USPS_CHOICES)
 
 
+class ResultsContentParser(HTMLParser):
+    """
+    Streaming parser that only extracts the address spans inside the #results-content container of a USPS
+    zip lookup results page. Feeding can stop as soon as every span has been found.
+    """
+
+    VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen',
+                     'link', 'meta', 'param', 'source', 'track', 'wbr'}
+
+    def __init__(self, span_classes):
+        """
+        @param span_classes: classes of the spans to extract
+        @type span_classes: iterable
+        """
+        super().__init__(convert_charrefs=True)
+        self.span_classes = set(span_classes)
+        self.found = {}
+        self._depth = 0  # depth within #results-content, 0 when outside
+        self._capture = None  # class of the span currently being captured
+        self._capture_depth = 0
+        self._text = []
+
+    @property
+    def done(self):
+        return len(self.found) == len(self.span_classes)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.VOID_ELEMENTS:
+            return
+        attrs = dict(attrs)
+        if self._depth == 0:
+            if attrs.get('id') == 'results-content':
+                self._depth = 1
+            return
+
+        self._depth += 1
+        if self._capture is not None:
+            if tag == 'span':
+                self._capture_depth += 1
+        elif tag == 'span':
+            for cls in (attrs.get('class') or '').split():
+                if cls in self.span_classes and cls not in self.found:
+                    self._capture, self._capture_depth, self._text = cls, 1, []
+                    break
+
+    def handle_endtag(self, tag):
+        if self._depth == 0 or tag in self.VOID_ELEMENTS:
+            return
+        self._depth -= 1
+        if self._capture is not None and tag == 'span':
+            self._capture_depth -= 1
+            if self._capture_depth == 0:
+                self.found[self._capture] = ''.join(self._text).strip()
+                self._capture = None
+
+    def handle_data(self, data):
+        if self._capture is not None:
+            self._text.append(data)
+
+
 class USPSScraper:
 
     USPS_BASE_URL = 'https://tools.usps.com/go/ZipLookupResultsAction!input.action'
 
+    # 'targeted' streams the response through ResultsContentParser, 'soup' parses the whole page with BeautifulSoup
+    PARSER = 'targeted'
+
+    # address field -> class of the span holding it in the results page
+    ADDRESS_SPANS = (('street_address', 'address1'), ('city', 'city'), ('state', 'state'),
+                     ('zip5', 'zip'), ('zip4', 'zip4'))
+
+    # the results container's id attribute in any quote style
+    RESULTS_MARKER = re.compile(r"""id\s*=\s*["']?results-content\b""")
+    MAX_TAG_LENGTH = 512
+
+    _local = threading.local()
+
     @staticmethod
-    def usps_request(**kwargs):
+    def session():
+        """
+        Keep-alive session reused across lookups on the same thread so the TLS connection to USPS is pooled.
+
+        @return: requests session for this thread
+        @rtype: requests.Session
+        """
+        if getattr(USPSScraper._local, 'session', None) is None:
+            session = requests.Session()
+            # need to spoof headers or get infinite redirect
+            session.headers['User-Agent'] = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_0) AppleWebKit/537.36 ' \
+                                            '(KHTML, like Gecko) Chrome/39.0.2171.99 Safari/537.36'
+            USPSScraper._local.session = session
+        return USPSScraper._local.session
+
+    @staticmethod
+    def usps_request(stream=False, **kwargs):
 
         # construct get parameters string
         params = {
@@ -25,50 +119,93 @@ class USPSScraper:
             'zip': kwargs.get('zip5', '')
         }
 
-        # make request. need to spoof headers or get infinite redirect
-        return requests.get(USPSScraper.USPS_BASE_URL, params=params, verify=True,
-                            headers={'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_0) AppleWebKit/537.36'
-                                                   ' (KHTML, like Gecko) Chrome/39.0.2171.99 Safari/537.36'},
-                            timeout=5)
+        return USPSScraper.session().get(USPSScraper.USPS_BASE_URL, params=params, verify=True,
+                                         timeout=5, stream=stream)
 
     @staticmethod
-    def usps_address_lookup(queue=None, **kwargs):
+    def _build_address(found):
+        address = {}
+        for field, span_class in USPSScraper.ADDRESS_SPANS:
+            if span_class in found:
+                address[field] = found[span_class]
+            else:
+                address[field] = ''
+                print("Can't find " + field)
+        address['city'] = address['city'].title()
+        return address
 
-        # parse html
-        soup = BeautifulSoup(USPSScraper.usps_request(**kwargs).text, 'html.parser')
+    @staticmethod
+    def parse_results_soup(html):
+        """
+        Parses a results page by building the whole document tree with BeautifulSoup.
 
-        # get container div for results
-        results_content = soup.find(id='results-content')
+        @param html: the results page
+        @type html: str
+        @return: address dictionary
+        @rtype: dict
+        """
+        results_content = BeautifulSoup(html, 'html.parser').find(id='results-content')
+        found = {}
+        for field, span_class in USPSScraper.ADDRESS_SPANS:
+            try:
+                found[span_class] = str(results_content.find('span', class_=span_class).text).strip()
+            except:
+                continue
+        return USPSScraper._build_address(found)
 
-        # build return dict
-        address = {
-            'street_address': '',
-            'city': '',
-            'state': '',
-            'zip5': '',
-            'zip4': ''
-        }
+    @staticmethod
+    def parse_results_targeted(chunks):
+        """
+        Parses a results page incrementally and stops as soon as every address span has been found. If the page
+        doesn't look the way the parser expects, i.e. no zip code is found, the whole page is parsed with
+        parse_results_soup instead so a markup change makes lookups slower rather than empty.
+
+        @param chunks: the results page as a string or an iterable of string/bytes chunks
+        @type chunks: str|iterable
+        @return: address dictionary
+        @rtype: dict
+        """
+        if isinstance(chunks, str):
+            chunks = [chunks]
+        parser = ResultsContentParser(span_class for field, span_class in USPSScraper.ADDRESS_SPANS)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        chunks = iter(chunks)
+        page = []  # everything read so far in case the page has to be parsed with parse_results_soup
+        # skip the page chrome entirely: nothing is fed to the parser until the results container's tag starts
+        skipped = ''
+        for chunk in chunks:
+            if isinstance(chunk, bytes):
+                chunk = decoder.decode(chunk)
+            page.append(chunk)
+            if skipped is not None:
+                skipped += chunk
+                match = USPSScraper.RESULTS_MARKER.search(skipped)
+                if match is None:
+                    skipped = skipped[-USPSScraper.MAX_TAG_LENGTH:]
+                    continue
+                chunk, skipped = skipped[max(skipped.rfind('<', 0, match.start()), 0):], None
+            parser.feed(chunk)
+            if parser.done:
+                break
+
+        if 'zip' not in parser.found:
+            for chunk in chunks:
+                page.append(decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)
+            return USPSScraper.parse_results_soup(''.join(page))
+        return USPSScraper._build_address(parser.found)
 
-        try:
-            address['street_address'] = str(results_content.find('span', class_='address1').text).strip()
-        except:
-            print("Can't find street address")
-        try:
-            address['city'] = str(results_content.find('span', class_='city').text).strip().title()
-        except:
-            print("Can't find city")
-        try:
-            address['state'] = str(results_content.find('span', class_='state').text).strip()
-        except:
-            print("Can't find state")
-        try:
-            address['zip5'] = str(results_content.find('span', class_='zip').text).strip()
-        except:
-            print("Can't find zip5")
-        try:
-            address['zip4'] = str(results_content.find('span', class_='zip4').text).strip()
-        except:
-            print("Can't find zip4")
+    @staticmethod
+    def usps_address_lookup(queue=None, parser=None, **kwargs):
+
+        if (parser or USPSScraper.PARSER) == 'soup':
+            address = USPSScraper.parse_results_soup(USPSScraper.usps_request(**kwargs).text)
+        else:
+            response = USPSScraper.usps_request(stream=True, **kwargs)
+            chunks = response.iter_content(chunk_size=8192, decode_unicode=True)
+            address = USPSScraper.parse_results_targeted(chunks)
+            # read the rest of the body without parsing it so the connection goes back to the pool
+            for _ in chunks:
+                pass
 
         if queue:
             queue.put(address)
@@ -92,4 +229,4 @@ class USPSScraper:
         """
 
         address = USPSScraper.usps_address_lookup(street_address=street_address, city=city, state=state, zip5=z5)
-        return address['zip5'], address['zip4']
\ No newline at end of file
+        return address['zip5'], address['zip4']
@@ -0,0 +1,84 @@
+import bisect
+import csv
+from array import array
+
+
+class ZipDistrictTable():
+    """
+    Offline lookup of the congressional districts that a ZIP code (ZCTA) falls in.
+
+    Rows are kept in parallel arrays sorted by zip so that a table of the ~40,000 ZCTAs costs a few hundred
+    kilobytes and each lookup is a pair of bisections.
+    """
+
+    # district codes the Census uses for at-large seats and non-voting delegates
+    AT_LARGE_CODES = ('00', '98')
+
+    def __init__(self, rows=()):
+        """
+        @param rows: iterable of (zip5, state, district) tuples
+        @type rows: iterable
+        """
+        self.states = []
+        self.zips = array('l')
+        self.state_indexes = array('B')
+        self.districts = array('b')
+
+        state_lookup = {}
+        for zip5, state, district in sorted(rows, key=lambda r: (int(r[0]), r[1], int(r[2]))):
+            if state not in state_lookup:
+                state_lookup[state] = len(self.states)
+                self.states.append(state)
+            self.zips.append(int(zip5))
+            self.state_indexes.append(state_lookup[state])
+            self.districts.append(int(district))
+
+    def __len__(self):
+        return len(self.zips)
+
+    @classmethod
+    def from_census_file(cls, path, fips_to_state):
+        """
+        Loads the Census ZCTA to congressional district relationship file, e.g. natl_zccd_delim.txt, which
+        has the header "State,ZCTA,Congressional District" and FIPS coded states.
+
+        @param path: path to the relationship file
+        @type path: str
+        @param fips_to_state: mapping of two digit FIPS codes to postal state abbreviations
+        @type fips_to_state: dict[str, str]
+        @return: the loaded table
+        @rtype: ZipDistrictTable
+        """
+        rows = []
+        with open(path, mode='r') as f:
+            reader = csv.reader(f)
+            next(reader, None)  # header
+            for line in reader:
+                if len(line) < 3 or line[0] not in fips_to_state:
+                    continue
+                district = '0' if line[2] in cls.AT_LARGE_CODES else line[2]
+                if not district.isdigit():
+                    # 'ZZ' marks water-only areas that aren't part of any district
+                    continue
+                rows.append((line[1], fips_to_state[line[0]], district))
+        return cls(rows)
+
+    def lookup(self, zip5):
+        """
+        Finds the districts for a zip code in the same form as the Sunlight congress API locate_districts_by_zip.
+
+        @param zip5: five digit zip code
+        @type zip5: str|int
+        @return: list of dictionaries with state and district, or None if the zip code isn't in the table
+        @rtype: list[dict]|None
+        """
+        try:
+            key = int(zip5)
+        except (TypeError, ValueError):
+            return None
+
+        lo = bisect.bisect_left(self.zips, key)
+        hi = bisect.bisect_right(self.zips, key, lo)
+        if lo == hi:
+            return None
+        return [{'state': self.states[self.state_indexes[i]], 'district': self.districts[i]} for i in range(lo, hi)]
@@ -1,11 +1,116 @@
+"""
+Fills in a partially entered address, i.e. city, state and zip code, either from USPS or from the geocoder.
+"""
+import threading
+from concurrent import futures
+
 import stopit
+from django.conf import settings
 
 from lib.usps import USPSScraper
 from services.geolocation_service import geolocate, reverse_geolocate
 
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _autofill_config():
+    config = {'hedge': False, 'timeout': 4, 'max_workers': 8, 'delays': {'usps': 0, 'geocoder': 1}}
+    config.update(settings.CONFIG_DICT.get('autofill', {}))
+    return config
+
+
+def _backend_executor(backend):
+    """
+    Each backend gets its own pool so lookups that lose the race and are stuck on a slow USPS or geocoder request
+    only hold up later lookups against that same backend.
+
+    @param backend: 'usps' or 'geocoder'
+    @type backend: str
+    @rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    if backend not in _executors:
+        with _executors_lock:
+            if backend not in _executors:
+                _executors[backend] = futures.ThreadPoolExecutor(max_workers=_autofill_config()['max_workers'])
+    return _executors[backend]
+
+
+def _is_complete(address):
+    return bool(address) and all(address.get(field) for field in ['city', 'state', 'zip5', 'zip4'])
+
+
+def _usps_address_lookup(**kwargs):
+    return USPSScraper.usps_address_lookup(**kwargs)
+
+
+def _geocoder_address_lookup(**kwargs):
+    lat, lng = geolocate(**kwargs)
+    return reverse_geolocate(lat, lng, state=kwargs.get('state', ''))
+
+
+def _after_delay(delay, wake, finished, func, **kwargs):
+    # a backend whose delay outlasts the race never makes its (possibly paid) request
+    if delay:
+        wake.wait(delay)
+    if finished.is_set():
+        return None
+    return func(**kwargs)
+
+
+def hedged_address_lookup(timeout=4, delays=None, **kwargs):
+    """
+    Races USPS against the geocoder and returns the first complete address. Each backend starts after its
+    hedging delay so that e.g. paid geocoder credits are only spent when USPS is slow.
+
+    @param timeout: seconds to wait for a complete answer
+    @type timeout: int|float
+    @param delays: seconds to wait before starting each backend keyed by 'usps' and 'geocoder'
+    @type delays: dict
+    @return: the first complete address, else the most complete partial answer, else None
+    @rtype: dict|None
+    """
+    delays = delays or {}
+    wake, finished = threading.Event(), threading.Event()
+    backends = [('usps', _usps_address_lookup), ('geocoder', _geocoder_address_lookup)]
+    pending = [_backend_executor(backend).submit(_after_delay, delays.get(backend, 0), wake, finished, func, **kwargs)
+               for backend, func in backends]
+
+    partial = None
+    try:
+        for future in futures.as_completed(pending, timeout=timeout):
+            try:
+                address = future.result()
+            except:
+                address = None
+            if _is_complete(address):
+                return address
+            elif address and partial is None:
+                partial = address
+            # a backend came up short so start any that are still waiting out their delay
+            wake.set()
+    except futures.TimeoutError:
+        pass
+    finally:
+        # cancel the loser: if it hasn't been picked up by a worker it never runs, if it's waiting out its delay it
+        # returns without making a request, and a request already in flight finishes in its backend's own pool
+        finished.set()
+        wake.set()
+        for future in pending:
+            future.cancel()
+
+    return partial
+
 
 def address_lookup(**kwargs):
 
+    config = _autofill_config()
+    if config['hedge']:
+        try:
+            return hedged_address_lookup(timeout=config['timeout'], delays=config['delays'], **kwargs)
+        except:
+            return None
+
     try:
         with stopit.ThreadingTimeout(4) as to_ctx_mgr:
             address = USPSScraper.usps_address_lookup(**kwargs)
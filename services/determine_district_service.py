@@ -1,7 +1,105 @@
+import os
+import threading
+
 import sunlight
 from django.conf import settings
+
+from lib.zip_districts import ZipDistrictTable
+from lib.district_boundaries import DistrictBoundaries
 from services.geolocation_service import geolocate
 
+_zip_table = None
+_zip_table_lock = threading.Lock()
+_boundaries = None
+_boundaries_lock = threading.Lock()
+
+
+def _fips_to_state():
+    from emailcongress.models import Legislator
+    return {v: k for k, v in Legislator.FIPS_CODES.items()}
+
+
+def zip_district_table():
+    """
+    Lazily loads the offline ZCTA to district table configured at paths.zip_district_table.
+
+    @return: the loaded table or None if no table is configured or it can't be found
+    @rtype: ZipDistrictTable|None
+    """
+    global _zip_table
+    if _zip_table is None:
+        with _zip_table_lock:
+            if _zip_table is None:
+                path = settings.CONFIG_DICT['paths'].get('zip_district_table')
+                table = ZipDistrictTable()
+                if path and os.path.exists(os.path.join(settings.BASE_DIR, path)):
+                    table = ZipDistrictTable.from_census_file(os.path.join(settings.BASE_DIR, path), _fips_to_state())
+                _zip_table = table
+    return _zip_table if len(_zip_table) else None
+
+
+def district_boundaries():
+    """
+    Lazily loads the district boundary files found under paths.district_boundaries into a spatial index.
+
+    @return: the loaded boundary engine or None if no boundaries are configured or found
+    @rtype: DistrictBoundaries|None
+    """
+    global _boundaries
+    if _boundaries is None:
+        with _boundaries_lock:
+            if _boundaries is None:
+                path = settings.CONFIG_DICT['paths'].get('district_boundaries')
+                engine = DistrictBoundaries()
+                if path and os.path.isdir(os.path.join(settings.BASE_DIR, path)):
+                    engine = DistrictBoundaries.from_directory(os.path.join(settings.BASE_DIR, path), _fips_to_state())
+                _boundaries = engine
+    return _boundaries if len(_boundaries) else None
+
+
+def locate_districts_by_lat_lon(latitude, longitude, backend=None):
+    """
+    Looks up the district containing a point with the configured backend. The 'local' backend answers from
+    the in-process boundary engine and falls back to the Sunlight congress API ('sunlight') when it has no answer.
+
+    @param latitude: latitude of the point
+    @type latitude: float|str
+    @param longitude: longitude of the point
+    @type longitude: float|str
+    @param backend: 'local' or 'sunlight', defaults to misc.district_backend
+    @type backend: str
+    @return: list of dictionaries with state and district
+    @rtype: list[dict]|None
+    """
+    if backend is None:
+        backend = settings.CONFIG_DICT['misc'].get('district_backend', 'sunlight')
+
+    data = None
+    if backend == 'local':
+        engine = district_boundaries()
+        if engine is not None:
+            data = engine.lookup(latitude, longitude)
+    if data is None:
+        data = sunlight.congress.locate_districts_by_lat_lon(latitude, longitude)
+    return data
+
+
+def locate_districts_by_zip(zip5):
+    """
+    Looks up the districts for a zip code in the offline table and only falls back to the Sunlight
+    congress API when the table has no answer.
+
+    @param zip5: five digit zip code
+    @type zip5: str
+    @return: list of dictionaries with state and district
+    @rtype: list[dict]|None
+    """
+    table = zip_district_table()
+    data = table.lookup(zip5) if table is not None else None
+    if data is None:
+        data = sunlight.congress.locate_districts_by_zip(zip5)
+    return data
+
 
 def determine_district(**kwargs):
     try:
@@ -9,16 +107,18 @@ def determine_district(**kwargs):
     except:
         raise
 
+    backend = kwargs.get('backend')
+
     if {'latitude', 'longitude'}.issubset(set(kwargs)):
-        data = sunlight.congress.locate_districts_by_lat_lon(kwargs.get('latitude'), kwargs.get('longitude'))
+        data = locate_districts_by_lat_lon(kwargs.get('latitude'), kwargs.get('longitude'), backend)
     elif 'zip5' in kwargs:
-        data = sunlight.congress.locate_districts_by_zip(kwargs.get('zip5'))
+        data = locate_districts_by_zip(kwargs.get('zip5'))
         if data is not None and len(data) > 1 and {'street_address', 'city', 'state'}.issubset(set(kwargs)):
             lat, lng = geolocate(state=kwargs.get('state'),
                                  street_address=kwargs.get('street_address'),
                                  city=kwargs.get('city'),
                                  zip5=kwargs.get('zip5'))
-            data = sunlight.congress.locate_districts_by_lat_lon(lat, lng)
+            data = locate_districts_by_lat_lon(lat, lng, backend)
     else:
         raise KeyError('Must provide appropriate keyword arguments')
 
@@ -1,22 +1,138 @@
+import hashlib
+import re
+
 from django.conf import settings
+from django.core.cache import cache
+
 from lib import geocoder
+from emailcongress.caching import LRUCache, CacheStats
 
+ADDRESS_ABBREVIATIONS = {
+    'street': 'st', 'avenue': 'ave', 'boulevard': 'blvd', 'road': 'rd', 'drive': 'dr', 'lane': 'ln',
+    'court': 'ct', 'place': 'pl', 'terrace': 'ter', 'circle': 'cir', 'highway': 'hwy', 'parkway': 'pkwy',
+    'square': 'sq', 'trail': 'trl', 'apartment': 'apt', 'suite': 'ste', 'north': 'n',
+    'south': 's', 'east': 'e', 'west': 'w', 'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se',
+    'southwest': 'sw'
+}
 
-def geolocate(**kwargs):
+_local_cache = LRUCache(maxsize=settings.CONFIG_DICT['misc'].get('geocode_lru_size', 1024))
+stats = CacheStats('local_hits', 'shared_hits', 'misses', shared_prefix='geocode-stats')
+
+
+def normalize_address(street_address='', city='', state='', zip5=''):
+    """
+    Normalizes the parts of an address so that trivially different spellings of the same address
+    (case, whitespace, punctuation, common suffix abbreviations) share a cache entry.
+
+    @return: normalized address string
+    @rtype: str
+    """
+    parts = []
+    for part in [street_address, city, state, zip5]:
+        words = re.sub(r'[.,#]', ' ', str(part or '')).lower().split()
+        parts.append(' '.join(ADDRESS_ABBREVIATIONS.get(w, w) for w in words))
+    return '|'.join(parts)
+
+
+def _cache_key(prefix, value):
+    return '{0}:{1}'.format(prefix, hashlib.sha1(value.encode('utf-8')).hexdigest())
+
+
+def _cached(key, func, is_match):
+    """
+    Looks up a geocoder result in the in-process LRU, then the shared cache, and finally calls the geocoder.
+    Matched results are cached for misc.geocode_cache_ttl. Results that didn't match are only kept in the shared
+    cache for misc.geocode_miss_cache_ttl so a bad or transient answer is soon retried, and failed calls aren't
+    cached at all.
+
+    @param key: cache key of the lookup
+    @type key: str
+    @param func: calls the geocoder
+    @type func: callable
+    @param is_match: whether a result is a usable match
+    @type is_match: callable
+    """
+    result = _local_cache.get(key)
+    if result is not None:
+        stats.incr('local_hits')
+        return result
+
+    result = cache.get(key)
+    if result is not None:
+        stats.incr('shared_hits')
+    else:
+        stats.incr('misses')
+        result = func()
+        if result is None:
+            return result
+        if not is_match(result):
+            cache.set(key, result, timeout=settings.CONFIG_DICT['misc'].get('geocode_miss_cache_ttl', 60 * 5))
+            return result
+        cache.set(key, result, timeout=settings.CONFIG_DICT['misc'].get('geocode_cache_ttl', 60 * 60 * 24 * 30))
+
+    if is_match(result):
+        _local_cache.set(key, result)
+    return result
+
+
+def is_matched_point(result):
+    """
+    @param result: latitude and longitude returned by the geocoder
+    @type result: tuple
+    @return: whether the geocoder matched the address, it answers (0, 0) when it couldn't
+    @rtype: bool
+    """
     try:
-        geo = geocoder.Geocoder('TexasAm', {'apiKey': settings.CONFIG_DICT['api_keys']['texas_am']})
-        geo.lookup(**kwargs)
-        return geo.lat_long()
-    except KeyError:
-        raise
-        # TODO robust error handling
+        lat, lng = float(result[0]), float(result[1])
+    except (TypeError, ValueError, IndexError):
+        return False
+    return not (lat == 0 and lng == 0)
+
+
+def is_matched_address(result):
+    """
+    @param result: address returned by the reverse geocoder
+    @type result: dict
+    @return: whether the reverse geocoder found an address with a zip code
+    @rtype: bool
+    """
+    return bool(result.get('street_address') and result.get('zip5'))
+
+
+def cache_stats(shared=True):
+    """
+    @param shared: whether to report totals across every process rather than just this one
+    @type shared: bool
+    @return: counts of in-process hits, shared cache hits, and misses (paid geocoder calls)
+    @rtype: dict[str, int]
+    """
+    return stats.shared_dict() if shared else stats.as_dict()
+
+
+def geolocate(**kwargs):
+    def lookup():
+        try:
+            geo = geocoder.Geocoder('TexasAm', {'apiKey': settings.CONFIG_DICT['api_keys']['texas_am']})
+            geo.lookup(**kwargs)
+            return geo.lat_long()
+        except KeyError:
+            raise
+            # TODO robust error handling
+
+    address = normalize_address(kwargs.get('street_address'), kwargs.get('city'),
+                                kwargs.get('state'), kwargs.get('zip5'))
+    return _cached(_cache_key('geocode', address), lookup, is_matched_point)
 
 
 def reverse_geolocate(lat, lng, state=''):
-    try:
-        geo = geocoder.Geocoder('TexasAm', {'apiKey': settings.CONFIG_DICT['api_keys']['texas_am']})
-        geo.reverse_lookup(lat, lng, state=state)
-        return geo.address()
-    except KeyError:
-        raise
-        # TODO robust error handling
+    def lookup():
+        try:
+            geo = geocoder.Geocoder('TexasAm', {'apiKey': settings.CONFIG_DICT['api_keys']['texas_am']})
+            geo.reverse_lookup(lat, lng, state=state)
+            return geo.address()
+        except KeyError:
+            raise
+            # TODO robust error handling
+
+    point = '{0:.6f}|{1:.6f}|{2}'.format(float(lat), float(lng), (state or '').upper())
+    return _cached(_cache_key('reverse-geocode', point), lookup, is_matched_address)
@@ -0,0 +1,212 @@
+"""
+Queue of rendered outbound emails that are sent in batches with Postmark's batch API. Emails are sent at least once:
+a worker that dies after Postmark accepted a batch but before the batch was recorded leaves its emails to be sent
+again by a later flush.
+"""
+import json
+import uuid
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from postmark.core import PMJSONEncoder
+
+POSTMARK_BATCH_URL = 'https://api.postmarkapp.com/email/batch'
+# Postmark accepts at most 500 messages per batch call
+POSTMARK_BATCH_MAX = 500
+
+_FLUSH_SCHEDULED_KEY = 'outbound-email:flush-scheduled'
+_QUEUED_COUNT_KEY = 'outbound-email:queued'
+_RETRY_SCHEDULED_KEY = 'outbound-email:retry-scheduled'
+
+
+def outbound_config():
+    config = {'queue': False, 'batch_size': POSTMARK_BATCH_MAX, 'max_delay': 10, 'max_attempts': 3,
+              'max_backoff': 3600}
+    config.update(settings.CONFIG_DICT.get('outbound_email', {}))
+    config['batch_size'] = min(int(config['batch_size']), POSTMARK_BATCH_MAX)
+    return config
+
+
+def enqueue(mail):
+    """
+    Stores a rendered email to be sent with the next batch. A flush is started right away once a batch worth of
+    emails is queued and otherwise within max_delay seconds. Flushes are started once the caller's transaction
+    commits so the worker can see the email.
+
+    @param mail: the rendered email
+    @type mail: postmark.PMMail
+    @return: the queued email
+    @rtype: emailcongress.models.OutboundEmail
+    """
+    from emailcongress.models import OutboundEmail
+    from emailcongress.celery import flush_outbound_email
+
+    mail._check_values()
+    # round trip through postmark's encoder so attachments and the like are stored as plain json
+    payload = json.loads(json.dumps(mail.to_json_message(), cls=PMJSONEncoder))
+    outbound = OutboundEmail.objects.create(to=payload.get('To', ''), payload=payload)
+
+    config = outbound_config()
+    try:
+        queued = cache.incr(_QUEUED_COUNT_KEY)
+    except ValueError:
+        cache.add(_QUEUED_COUNT_KEY, 1, timeout=None)
+        queued = 1
+    if queued >= config['batch_size']:
+        cache.set(_QUEUED_COUNT_KEY, 0, timeout=None)
+        transaction.on_commit(lambda: flush_outbound_email.delay())
+    elif cache.add(_FLUSH_SCHEDULED_KEY, True, timeout=config['max_delay']):
+        transaction.on_commit(lambda: flush_outbound_email.apply_async(countdown=config['max_delay']))
+    return outbound
+
+
+def _post_batch(payloads):
+    response = requests.post(POSTMARK_BATCH_URL, data=json.dumps(payloads), timeout=30,
+                             headers={'Accept': 'application/json',
+                                      'Content-Type': 'application/json',
+                                      'X-Postmark-Server-Token': settings.POSTMARK_API_KEY})
+    response.raise_for_status()
+    return response.json()
+
+
+def is_transient(error):
+    """
+    @param error: exception raised by a Postmark call
+    @type error: Exception
+    @return: whether the call failed because Postmark couldn't be reached or had a server error
+    @rtype: bool
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return isinstance(error, requests.HTTPError) and error.response is not None and error.response.status_code >= 500
+
+
+def send_batch(outbound_emails, max_attempts=3):
+    """
+    Sends emails with one Postmark batch call and records the result of every email. If the whole call fails
+    the emails are queued again. Only calls that Postmark rejected count toward max_attempts, so emails survive
+    Postmark being unreachable or having a server error for any length of time.
+
+    @param outbound_emails: emails to send, at most POSTMARK_BATCH_MAX
+    @type outbound_emails: list[emailcongress.models.OutboundEmail]
+    @param max_attempts: number of attempts before an email is marked failed
+    @type max_attempts: int
+    @return: counts of sent and failed emails
+    @rtype: dict[str, int]
+    """
+    counts = {'sent': 0, 'failed': 0, 'requeued': 0}
+    now = timezone.now()
+    try:
+        results = _post_batch([outbound.payload for outbound in outbound_emails])
+    except Exception as e:
+        transient = is_transient(e)
+        for outbound in outbound_emails:
+            if not transient:
+                outbound.attempts += 1
+            outbound.error = str(e)
+            outbound.status = 'failed' if outbound.attempts >= max_attempts else 'queued'
+            outbound.batch = None
+            outbound.save()
+            counts['failed' if outbound.status == 'failed' else 'requeued'] += 1
+        return counts
+
+    # postmark returns one result per message in the order they were sent
+    for outbound, result in zip(outbound_emails, results):
+        outbound.attempts += 1
+        outbound.error_code = result.get('ErrorCode', 0)
+        if outbound.error_code == 0:
+            outbound.status = 'sent'
+            outbound.postmark_message_id = result.get('MessageID')
+            outbound.sent_at = now
+            outbound.error = None
+        else:
+            outbound.status = 'failed'
+            outbound.error = result.get('Message')
+        outbound.save()
+        counts[outbound.status] += 1
+    return counts
+
+
+def flush(batch_size=None, max_batches=100):
+    """
+    Sends queued emails in batches. Each batch is claimed by tagging its rows with a batch id so concurrent
+    flushes don't pick up the same emails. Batches left 'sending' by a flush that died are queued again after ten
+    minutes, which resends them if Postmark had already accepted them.
+
+    @param batch_size: number of emails per Postmark call
+    @type batch_size: int
+    @param max_batches: maximum number of batches to send in this flush
+    @type max_batches: int
+    @return: counts of sent, failed and requeued emails
+    @rtype: dict[str, int]
+    """
+    from emailcongress.models import OutboundEmail
+
+    config = outbound_config()
+    batch_size = min(int(batch_size or config['batch_size']), POSTMARK_BATCH_MAX)
+    cache.delete(_FLUSH_SCHEDULED_KEY)
+    cache.set(_QUEUED_COUNT_KEY, 0, timeout=None)
+
+    # batches whose flush died mid send (the Postmark call times out long before this)
+    OutboundEmail.objects.filter(status='sending', updated_at__lt=timezone.now() - timedelta(minutes=10)) \
+        .update(status='queued', batch=None, updated_at=timezone.now())
+
+    totals = {'sent': 0, 'failed': 0, 'requeued': 0}
+    for i in range(max_batches):
+        ids = list(OutboundEmail.objects.filter(status='queued').order_by('id')
+                   .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        batch = uuid.uuid4().hex
+        OutboundEmail.objects.filter(id__in=ids, status='queued').update(status='sending', batch=batch,
+                                                                         updated_at=timezone.now())
+        claimed = list(OutboundEmail.objects.filter(batch=batch).order_by('id'))
+        for name, count in send_batch(claimed, max_attempts=config['max_attempts']).items():
+            totals[name] += count
+        if totals['requeued']:
+            # postmark is unreachable so leave the rest for the next flush
+            break
+    return totals
+
+
+def schedule_retry(retries):
+    """
+    Schedules a flush of emails that were queued again because Postmark couldn't be reached. The delay doubles with
+    every consecutive retry, from max_delay up to max_backoff seconds, and only one retry is scheduled at a time.
+
+    @param retries: number of consecutive flushes that have been retried
+    @type retries: int
+    @return: seconds until the retry or None if one is already scheduled
+    @rtype: int|None
+    """
+    from emailcongress.celery import flush_outbound_email
+
+    config = outbound_config()
+    countdown = min(config['max_delay'] * 2 ** retries, config['max_backoff'])
+    if not cache.add(_RETRY_SCHEDULED_KEY, True, timeout=countdown):
+        return None
+    flush_outbound_email.apply_async(kwargs={'retries': retries + 1}, countdown=countdown)
+    return countdown
+
+
+def requeue_failed(include_rejected=False):
+    """
+    Queues failed emails to be sent again, e.g. after a Postmark outage outlasted max_attempts.
+
+    @param include_rejected: also queue emails that Postmark rejected individually (e.g. an inactive recipient)
+    @type include_rejected: bool
+    @return: number of queued emails
+    @rtype: int
+    """
+    from emailcongress.models import OutboundEmail
+
+    failed = OutboundEmail.objects.filter(status='failed')
+    if not include_rejected:
+        # emails whose whole batch failed have no error code of their own
+        failed = failed.filter(Q(error_code=None) | Q(error_code=0))
+    return failed.update(status='queued', batch=None, attempts=0, updated_at=timezone.now())
@@ -0,0 +1,123 @@
+import threading
+from concurrent import futures
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+
+from emailcongress import caching
+from lib.phantom_on_the_capitol import PhantomOfTheCapitol
+
+FORM_ELEMENTS_NAMESPACE = 'phantom-form-elements'
+
+_executor = None
+_executor_lock = threading.Lock()
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def phantom_config():
+    config = {'max_workers': 4, 'per_host_max': 1, 'timeout': 120, 'per_legislator_tasks': False,
+              'batch_size': 25}
+    config.update(settings.CONFIG_DICT.get('phantom', {}))
+    return config
+
+
+def _fill_out_form_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = futures.ThreadPoolExecutor(max_workers=phantom_config()['max_workers'])
+    return _executor
+
+
+def _host_semaphore(host):
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(phantom_config()['per_host_max'])
+        return _host_semaphores[host]
+
+
+def contact_form_host(contact_form):
+    """
+    @param contact_form: URL of a legislator's contact form
+    @type contact_form: str
+    @return: host name of the contact form, used to cap concurrent submissions to the same office website
+    @rtype: str
+    """
+    return urlparse(contact_form or '').netloc.lower()
+
+
+def _form_elements_key(bioguide_id):
+    return 'form-elements:' + bioguide_id
+
+
+def retrieve_form_elements(phantom, bioguide_ids):
+    """
+    Retrieves the required actions for the contact forms of legislators. Results are cached per bioguide_id in
+    the shared cache so that every worker only asks phantom of the capitol for the legislators it hasn't seen
+    since the last legislator import (see invalidate_form_elements).
+
+    @param phantom: phantom of the capitol client
+    @type phantom: lib.phantom_on_the_capitol.PhantomOfTheCapitol
+    @param bioguide_ids: bioguide ids of the legislators
+    @type bioguide_ids: list[str]
+    @return: required actions keyed by bioguide_id or None if nothing could be retrieved
+    @rtype: dict|None
+    """
+    version = caching.get_namespace_version(FORM_ELEMENTS_NAMESPACE)
+    cached = cache.get_many([_form_elements_key(bgi) for bgi in bioguide_ids], version=version)
+    form_elements = {bgi: cached[_form_elements_key(bgi)] for bgi in bioguide_ids if _form_elements_key(bgi) in cached}
+
+    missing = [bgi for bgi in bioguide_ids if bgi not in form_elements]
+    if missing:
+        retrieved = phantom.retrieve_form_elements(missing)
+        if retrieved is None:
+            return form_elements or None
+        cache.set_many({_form_elements_key(bgi): ra for bgi, ra in retrieved.items()},
+                       timeout=settings.CONFIG_DICT['misc'].get('form_elements_cache_ttl', 60 * 60 * 24),
+                       version=version)
+        form_elements.update(retrieved)
+
+    return form_elements
+
+
+def invalidate_form_elements():
+    """
+    Invalidates every cached set of required actions, e.g. after legislators are imported.
+    """
+    caching.bump_namespace_version(FORM_ELEMENTS_NAMESPACE)
+
+
+def _fill_out_form_on_host(phantom, host, json_dict):
+    with _host_semaphore(host):
+        return phantom.fill_out_form(json_dict)
+
+
+def phantom_client():
+    """
+    @return: phantom of the capitol client with the configured per-call timeout
+    @rtype: lib.phantom_on_the_capitol.PhantomOfTheCapitol
+    """
+    return PhantomOfTheCapitol(endpoint=settings.CONFIG_DICT['api_endpoints']['phantom_base'],
+                               opts={'timeout': phantom_config()['timeout']})
+
+
+def fill_out_forms(phantom, submissions):
+    """
+    Submits forms to phantom of the capitol concurrently through a bounded thread pool of phantom.max_workers
+    threads. At most phantom.per_host_max submissions run at once against the same contact form host. Each
+    call is bounded by the client's timeout.
+
+    @param phantom: phantom of the capitol client
+    @type phantom: lib.phantom_on_the_capitol.PhantomOfTheCapitol
+    @param submissions: (contact form host, json dict for fill_out_form) tuples
+    @type submissions: list[tuple]
+    @return: phantom of the capitol results, or None for failures and timeouts, in the order of submissions
+    @rtype: list[dict|None]
+    """
+    executor = _fill_out_form_executor()
+    pending = [executor.submit(_fill_out_form_on_host, phantom, host, json_dict) for host, json_dict in submissions]
+    futures.wait(pending)
+    return [future.result() if future.exception() is None else None for future in pending]
@@ -0,0 +1,81 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import timezone
+
+from emailcongress.directory import legislator_directory
+from emailcongress.models import DjangoUser, User, UserMessageInfo, Message, Legislator
+
+
+class TokenViewQueryTests(TestCase):
+    """
+    Pins the number of queries SignupView, ConfirmRepsView and CompleteView make when they're opened with a message
+    token or a user token, including their post token handlers and templates.
+    """
+
+    def setUp(self):
+        self.legislators = [
+            Legislator.objects.create(bioguide_id='S000001', chamber='senate', state='VA', district=None, title='Sen',
+                                      first_name='First', last_name='Senator', email='Sen.Senator@emailcongress.us'),
+            Legislator.objects.create(bioguide_id='S000002', chamber='senate', state='VA', district=None, title='Sen',
+                                      first_name='Second', last_name='Senator', email='Sen.Second@emailcongress.us'),
+            Legislator.objects.create(bioguide_id='R000001', chamber='house', state='VA', district=8, title='Rep',
+                                      first_name='First', last_name='Representative',
+                                      email='Rep.Representative@emailcongress.us'),
+        ]
+
+        django_user = DjangoUser.objects.create(username='constituent@example.com', email='constituent@example.com')
+        self.user = User.objects.create(django_user=django_user)
+        self.umi = UserMessageInfo.objects.create(user=self.user, default=True, prefix='Ms.', first_name='Jane',
+                                                  last_name='Doe', street_address='1 Main St', city='Arlington',
+                                                  state='VA', zip5='22201', zip4='1234', phone_number='7035551234',
+                                                  district=8, accept_tos=timezone.now())
+        self.msg = Message.objects.create(to_originally=[leg.email for leg in self.legislators], subject='Subject',
+                                          msgbody='Body', email_uid='', user_message_info=self.umi)
+        self.user_key = self.user.token_key
+        self.msg_key = self.msg.token_key
+
+        # warm the per process caches so only the queries of the request are counted
+        legislator_directory.invalidate()
+        legislator_directory.all()
+        ContentType.objects.get_for_model(User)
+        ContentType.objects.get_for_model(Message)
+
+    def test_signup_with_message_token(self):
+        # token, message with its user message info and users
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('validate', kwargs={'token': self.msg_key}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_signup_with_message_token_redirect(self):
+        self.msg.set_legislators(self.legislators)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('validate', kwargs={'token': self.msg_key}))
+        self.assertRedirects(response, reverse('complete-verify', kwargs={'token': self.msg_key}),
+                             fetch_redirect_response=False)
+
+    def test_signup_with_user_token(self):
+        # token, user with its django user, default user message info
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('validate', kwargs={'token': self.user_key}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_confirm_reps_with_message_token(self):
+        # token, message with its user message info and users, default user message info for the rep cards
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('confirm', kwargs={'token': self.msg_key}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['legs_buckets']['contactable']), 3)
+
+    def test_complete_with_message_token(self):
+        self.msg.set_legislators(self.legislators)
+        # token, message with its user message info and users, message legislators, default user message info
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('complete-verify', kwargs={'token': self.msg_key}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_complete_with_user_token(self):
+        # token, user with its django user, default user message info
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('complete-verify', kwargs={'token': self.user_key}))
+        self.assertEqual(response.status_code, 200)